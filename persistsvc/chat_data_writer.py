@@ -0,0 +1,215 @@
+import cStringIO
+import datetime
+import logging
+
+from trsvcscore.db.models import ChatMinute, ChatSpeakingMarker, ChatTag
+
+
+class ChatDataWriter(object):
+    """
+    ChatDataWriter writes the rows returned by process_chat_messages
+    to the db.
+
+    Rows are written with multi-row INSERT statements executed on the
+    db session's psycopg2 connection, rather than through the ORM unit
+    of work, so a chat is written in a handful of round trips rather
+    than one per row. Minutes are inserted first, returning their ids,
+    which are then referenced by the speaking marker and tag rows.
+
+    Large numbers of speaking marker or tag rows are streamed with
+    COPY instead, which avoids building and parsing the INSERT
+    statements.
+
+    Since the session's connection is used, rows are written within
+    the session's current transaction (or savepoint).
+    """
+
+    # Maximum number of rows in a single INSERT statement
+    PAGE_SIZE = 500
+
+    # Minimum number of rows written to a table with COPY
+    COPY_THRESHOLD = 1000
+
+    def __init__(self, page_size=None, copy_threshold=None):
+        """Constructor.
+
+        Args:
+            page_size: optional maximum number of rows in a single
+                INSERT statement. Defaults to PAGE_SIZE.
+            copy_threshold: optional minimum number of speaking marker
+                or tag rows written with COPY. Defaults to COPY_THRESHOLD.
+        """
+        self.log = logging.getLogger(__name__)
+        self.page_size = page_size or self.PAGE_SIZE
+        self.copy_threshold = copy_threshold or self.COPY_THRESHOLD
+
+    def write(self, db_session, chat_session_id, rows):
+        """Write rows to the db.
+
+        Args:
+            db_session: sqlalchemy db session
+            chat_session_id: id of the chat session the rows belong to
+            rows: dict of rows returned by process_chat_messages
+        """
+        # Write pending ORM changes first, so they precede the rows
+        # written on the connection.
+        db_session.flush()
+
+        cursor = db_session.connection().connection.cursor()
+        try:
+            minute_ids = self._write_minutes(cursor, chat_session_id, rows["minutes"])
+            self._write_markers(cursor, minute_ids, rows["markers"])
+            self._write_tags(cursor, minute_ids, rows["tags"])
+        finally:
+            cursor.close()
+
+        self.log.debug("Wrote %d minutes, %d markers and %d tags for chat_session_id=%d" %
+                (len(rows["minutes"]), len(rows["markers"]), len(rows["tags"]), chat_session_id))
+
+    def _write_minutes(self, cursor, chat_session_id, rows):
+        """Write minute rows.
+
+        Args:
+            cursor: psycopg2 cursor
+            chat_session_id: id of the chat session
+            rows: list of minute row dicts
+        Returns:
+            dict of chat minute id by topic id
+        """
+        values = [(chat_session_id, row["topic_id"], row["start"], row["end"]) for row in rows]
+        returned = self._insert(
+                cursor,
+                ChatMinute,
+                ["chat_session_id", "topic_id", "start", "end"],
+                values,
+                returning=["id", "topic_id"])
+        return dict((topic_id, minute_id) for minute_id, topic_id in returned)
+
+    def _write_markers(self, cursor, minute_ids, rows):
+        """Write speaking marker rows.
+
+        Args:
+            cursor: psycopg2 cursor
+            minute_ids: dict of chat minute id by topic id
+            rows: list of speaking marker row dicts
+        """
+        values = [(row["user_id"], minute_ids[row["topic_id"]], row["start"], row["end"])
+                  for row in rows]
+        self._write(
+                cursor,
+                ChatSpeakingMarker,
+                ["user_id", "chat_minute_id", "start", "end"],
+                values)
+
+    def _write_tags(self, cursor, minute_ids, rows):
+        """Write tag rows.
+
+        Args:
+            cursor: psycopg2 cursor
+            minute_ids: dict of chat minute id by topic id
+            rows: list of tag row dicts
+        """
+        values = [(row["user_id"], row["time"], minute_ids[row["topic_id"]],
+                   row["tag_id"], row["name"], row["deleted"]) for row in rows]
+        self._write(
+                cursor,
+                ChatTag,
+                ["user_id", "time", "chat_minute_id", "tag_id", "name", "deleted"],
+                values)
+
+    def _write(self, cursor, model, columns, values):
+        """Write rows to a model's table.
+
+        Rows are written with COPY if there are at least
+        copy_threshold of them, and inserted otherwise.
+
+        Args:
+            cursor: psycopg2 cursor
+            model: model class of the table to write to
+            columns: list of column names
+            values: list of value tuples in column order
+        """
+        if len(values) >= self.copy_threshold:
+            self._copy(cursor, model, columns, values)
+        else:
+            self._insert(cursor, model, columns, values)
+
+    def _copy(self, cursor, model, columns, values):
+        """Copy rows into a model's table.
+
+        Rows are written to an in-memory buffer in COPY's text
+        format, which is then streamed to the db in one statement.
+
+        Args:
+            cursor: psycopg2 cursor
+            model: model class of the table to copy into
+            columns: list of column names
+            values: list of value tuples in column order
+        """
+        table = model.__table__
+        buffer = cStringIO.StringIO()
+        for value in values:
+            buffer.write("\t".join(self._copy_value(column_value) for column_value in value))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        sql = "COPY %s (%s) FROM STDIN" % (
+                table.fullname,
+                ", ".join(self._quote(table, column) for column in columns))
+        cursor.copy_expert(sql, buffer)
+
+    def _copy_value(self, value):
+        """Return a value in COPY's text format."""
+        if value is None:
+            return "\\N"
+        elif isinstance(value, bool):
+            return "t" if value else "f"
+        elif isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        elif isinstance(value, unicode):
+            value = value.encode("utf-8")
+        else:
+            value = str(value)
+
+        return value.replace("\\", "\\\\").\
+                replace("\t", "\\t").\
+                replace("\n", "\\n").\
+                replace("\r", "\\r")
+
+    def _insert(self, cursor, model, columns, values, returning=None):
+        """Insert rows into a model's table.
+
+        Rows are inserted page_size rows per statement.
+
+        Args:
+            cursor: psycopg2 cursor
+            model: model class of the table to insert into
+            columns: list of column names
+            values: list of value tuples in column order
+            returning: optional list of column names to return
+        Returns:
+            list of returned row tuples, if returning is specified.
+        """
+        table = model.__table__
+        sql = "INSERT INTO %s (%s) VALUES " % (
+                table.fullname,
+                ", ".join(self._quote(table, column) for column in columns))
+        placeholder = "(%s)" % ", ".join(["%s"] * len(columns))
+        if returning:
+            returning_sql = " RETURNING %s" % \
+                    ", ".join(self._quote(table, column) for column in returning)
+
+        results = []
+        for offset in range(0, len(values), self.page_size):
+            page = values[offset:offset + self.page_size]
+            statement = sql + ", ".join(cursor.mogrify(placeholder, value) for value in page)
+            if returning:
+                cursor.execute(statement + returning_sql)
+                results.extend(cursor.fetchall())
+            else:
+                cursor.execute(statement)
+        return results
+
+    def _quote(self, table, column):
+        """Return the quoted name of a table column."""
+        return '"%s"' % table.c[column].name
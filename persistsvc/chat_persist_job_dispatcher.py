@@ -0,0 +1,206 @@
+import logging
+import threading
+
+import zookeeper
+
+
+class ChatPersistJobDispatcher(object):
+    """
+    ChatPersistJobDispatcher distributes chat persist jobs through
+    a ZooKeeper work queue, with a single elected leader scanning
+    the db for jobs.
+
+    Leader election:
+        Each instance creates an ephemeral sequential node under
+        <path>/election. The instance with the lowest sequence
+        number is the leader. When the leader dies its node is
+        removed and the next instance takes over.
+
+    Work queue:
+        The leader publishes claimed jobs as persistent sequential
+        nodes under <path>/queue, named job-<job_id>-<priority>-<seq>,
+        so consumers need not read node data. Consumers take a job
+        by deleting its node; only one consumer's delete succeeds.
+
+    ZooKeeper watches only flag state as stale, since synchronous
+    ZooKeeper calls can not be made from the watch callback; state
+    is re-read on the next call to is_leader() or take().
+    """
+    def __init__(self, zookeeper_client, path, member_data, change_callback=None):
+        """Constructor.
+
+        Arguments:
+            zookeeper_client: started ZookeeperClient
+            path: ZooKeeper path for the dispatcher
+            member_data: data to store in this instance's election
+                node identifying the instance.
+            change_callback: optional callable invoked with no arguments
+                when the leader changes or jobs are published.
+        """
+        self.log = logging.getLogger(__name__)
+        self.zookeeper_client = zookeeper_client
+        self.path = path
+        self.election_path = "%s/election" % path
+        self.queue_path = "%s/queue" % path
+        self.member_data = member_data
+        self.change_callback = change_callback
+        self.lock = threading.Lock()
+        self.member_node = None
+        self.leader = False
+        self.election_stale = True
+        self.running = False
+
+    def start(self):
+        """Start dispatcher and join the election."""
+        if not self.running:
+            self.running = True
+            self.election_stale = True
+            self.is_leader()
+
+    def stop(self):
+        """Stop dispatcher and leave the election."""
+        if self.running:
+            self.running = False
+            with self.lock:
+                if self.member_node is not None:
+                    try:
+                        self.zookeeper_client.delete(
+                                "%s/%s" % (self.election_path, self.member_node))
+                    except Exception as error:
+                        self.log.exception(error)
+                    self.member_node = None
+                self.leader = False
+
+    def is_leader(self):
+        """Check if this instance is the leader.
+
+        Re-runs the election if the membership has changed.
+
+        Returns:
+            True if this instance is the leader, False otherwise.
+        """
+        with self.lock:
+            if self.running and self.election_stale:
+                try:
+                    self._elect()
+                except Exception as error:
+                    self.election_stale = True
+                    self.leader = False
+                    self.log.exception(error)
+            return self.leader
+
+    def publish(self, jobs):
+        """Publish jobs to the work queue.
+
+        Arguments:
+            jobs: list of (job_id, priority, created) tuples
+                in the order they should be consumed.
+        """
+        self._ensure_path(self.queue_path)
+        for job_id, priority, created in jobs:
+            self.zookeeper_client.create(
+                    "%s/job-%d-%d-" % (self.queue_path, job_id, priority),
+                    sequence=True)
+
+    def queue_size(self):
+        """Return the number of jobs in the work queue."""
+        try:
+            return len(self.zookeeper_client.get_children(self.queue_path))
+        except zookeeper.NoNodeException:
+            return 0
+
+    def get_queued_job_ids(self):
+        """Return a list of job ids in the work queue."""
+        try:
+            nodes = self.zookeeper_client.get_children(self.queue_path)
+        except zookeeper.NoNodeException:
+            return []
+        return [self._parse_queue_node(node)[0] for node in nodes]
+
+    def take(self, limit):
+        """Take jobs from the work queue.
+
+        Sets a watch on the queue so that change_callback is
+        invoked when new jobs are published.
+
+        Arguments:
+            limit: maximum number of jobs to take
+        Returns:
+            list of (job_id, priority) tuples in the order
+            they were published.
+        """
+        self._ensure_path(self.queue_path)
+        nodes = self.zookeeper_client.get_children(
+                self.queue_path,
+                watcher=self._on_changed)
+        nodes.sort(key=lambda node: node.rsplit("-", 1)[-1])
+
+        jobs = []
+        for node in nodes:
+            if len(jobs) >= limit:
+                break
+            try:
+                self.zookeeper_client.delete("%s/%s" % (self.queue_path, node))
+            except zookeeper.NoNodeException:
+                # Job was taken by another instance
+                continue
+            jobs.append(self._parse_queue_node(node))
+        return jobs
+
+    def _parse_queue_node(self, node):
+        """Parse work queue node name.
+
+        Returns:
+            (job_id, priority) tuple
+        """
+        prefix, job_id, priority, sequence = node.split("-")
+        return int(job_id), int(priority)
+
+    def _ensure_path(self, path):
+        """Create path and any missing parent nodes."""
+        current_path = ""
+        for node in path.strip("/").split("/"):
+            current_path = "%s/%s" % (current_path, node)
+            if not self.zookeeper_client.exists(current_path):
+                try:
+                    self.zookeeper_client.create(current_path)
+                except zookeeper.NodeExistsException:
+                    pass
+
+    def _elect(self):
+        """Join the election if needed and determine the leader."""
+        # Clear stale flag before reading members, with the watch
+        # set, so that changes during the election are not missed.
+        self.election_stale = False
+        if self.member_node is None or not self.zookeeper_client.exists(
+                "%s/%s" % (self.election_path, self.member_node)):
+            self._ensure_path(self.election_path)
+            node_path = self.zookeeper_client.create(
+                    "%s/member-" % self.election_path,
+                    self.member_data,
+                    sequence=True,
+                    ephemeral=True)
+            self.member_node = node_path.rsplit("/", 1)[-1]
+
+        members = self.zookeeper_client.get_children(
+                self.election_path,
+                watcher=self._on_election_changed)
+        members.sort(key=lambda node: node.rsplit("-", 1)[-1])
+
+        leader = bool(members) and members[0] == self.member_node
+        if leader != self.leader:
+            if leader:
+                self.log.info("Elected chat persist job dispatch leader as %s" % self.member_node)
+            else:
+                self.log.info("No longer chat persist job dispatch leader")
+        self.leader = leader
+
+    def _on_election_changed(self, event):
+        """ZooKeeper watch callback for election membership changes."""
+        self.election_stale = True
+        self._on_changed(event)
+
+    def _on_changed(self, event):
+        """ZooKeeper watch callback for queue and election changes."""
+        if self.running and self.change_callback:
+            self.change_callback()
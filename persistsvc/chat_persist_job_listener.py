@@ -0,0 +1,193 @@
+import logging
+import select
+import socket
+import threading
+
+import psycopg2.extensions
+
+
+class ChatPersistJobListener(object):
+    """
+    ChatPersistJobListener listens for new chat persist job notifications.
+
+    The listener holds a dedicated db connection which issues a
+    LISTEN on the given channel. A NOTIFY on that channel (issued
+    by a trigger on chat_persist_job inserts or by the chat service
+    when it creates a ChatPersistJob) results in the callback being
+    invoked immediately, allowing new jobs to be picked up without
+    waiting for the next poll.
+
+    Example trigger:
+        CREATE FUNCTION chat_persist_job_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('chat_persist_job', NEW.id::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER chat_persist_job_notify_trigger
+            AFTER INSERT ON chat_persist_job
+            FOR EACH ROW EXECUTE PROCEDURE chat_persist_job_notify();
+
+    If the connection is lost the listener reports itself as
+    disconnected, so callers can fall back to polling, and
+    attempts to reconnect every reconnect_seconds. TCP keepalives
+    are enabled on the connection, so a connection which is lost
+    without being closed, and so never becomes readable, is
+    detected as well.
+    """
+    def __init__(self, db_session_factory, channel, callback, reconnect_seconds=10,
+            keepalive_seconds=60):
+        """Constructor.
+
+        Arguments:
+            db_session_factory: callable returning a new sqlalchemy db session
+            channel: name of the notification channel to LISTEN on
+            callback: callable invoked with no arguments when a
+                notification is received, and each time the listener
+                (re)connects since notifications may have been missed
+                while disconnected.
+            reconnect_seconds: number of seconds to wait between
+                reconnect attempts.
+            keepalive_seconds: number of idle seconds after which
+                the connection is probed. A dead connection is
+                detected within about twice this interval.
+        """
+        self.log = logging.getLogger(__name__)
+        self.db_session_factory = db_session_factory
+        self.channel = channel
+        self.callback = callback
+        self.reconnect_seconds = reconnect_seconds
+        self.keepalive_seconds = keepalive_seconds
+        self.listenerThread = threading.Thread(target=self.run)
+        self.connection = None
+        self.connected = False
+
+        #conditional variable allowing speedy wakeup on exit.
+        self.exit = threading.Condition()
+
+        self.running = False
+
+    def is_connected(self):
+        """Check if the listener is currently receiving notifications.
+
+        Returns:
+            True if the listener holds a connection which is
+            listening on the channel, False otherwise.
+        """
+        return self.running and self.connected
+
+    def start(self):
+        """Start listener."""
+        if not self.running:
+            self.running = True
+            self.listenerThread.start()
+
+    def run(self):
+        """Listener thread run method."""
+        while self.running:
+            try:
+                self._connect()
+                self.log.info("ChatPersistJobListener listening on channel '%s'" % self.channel)
+                self.callback()
+
+                while self.running:
+                    # Wake up periodically to check self.running
+                    readable, writable, errored = select.select(
+                            [self.connection], [], [], 1)
+                    if readable:
+                        self.connection.poll()
+                        if self.connection.notifies:
+                            del self.connection.notifies[:]
+                            self.callback()
+
+            except Exception as error:
+                if self.running:
+                    self.log.exception(error)
+
+            finally:
+                self._disconnect()
+
+            # Wait before attempting to reconnect.
+            # Waiting on a conditional variable,
+            # allows the wait to be interrupted
+            # when stop() is called.
+            with self.exit:
+                if self.running:
+                    self.exit.wait(self.reconnect_seconds)
+
+    def _connect(self):
+        """Open a dedicated connection and LISTEN on the channel.
+
+        The connection is detached from the sqlalchemy connection
+        pool since it is held for the lifetime of the listener
+        and must be in autocommit mode to receive notifications.
+        """
+        db_session = self.db_session_factory()
+        try:
+            pool_connection = db_session.get_bind().raw_connection()
+        finally:
+            db_session.close()
+
+        pool_connection.detach()
+        self.connection = pool_connection.connection
+        self.connection.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = self.connection.cursor()
+        cursor.execute('LISTEN "%s";' % self.channel)
+        cursor.close()
+        self._enable_keepalive()
+        self.connected = True
+
+    def _enable_keepalive(self):
+        """Enable TCP keepalives on the listen connection.
+
+        The listener only reads from the connection, so if the
+        server goes away without closing it, select() keeps timing
+        out as if no notifications were sent. With keepalives, the
+        idle connection is probed and fails once three probes go
+        unanswered, after which the listener reconnects.
+
+        Connections over a unix domain socket do not support, or
+        need, TCP keepalives, so failures are only logged.
+        """
+        options = [
+            ("TCP_KEEPIDLE", self.keepalive_seconds),
+            ("TCP_KEEPINTVL", max(1, self.keepalive_seconds / 3)),
+            ("TCP_KEEPCNT", 3)
+        ]
+
+        sock = socket.fromfd(self.connection.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for name, value in options:
+                # Keepalive tuning options are platform specific
+                if hasattr(socket, name):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+        except socket.error as error:
+            self.log.info("Unable to enable TCP keepalives on listen connection: %s" % str(error))
+        finally:
+            # Closes the duplicated descriptor only
+            sock.close()
+
+    def _disconnect(self):
+        """Close the listen connection if open."""
+        self.connected = False
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception as error:
+                self.log.exception(error)
+            self.connection = None
+
+    def stop(self):
+        """Stop listener."""
+        if self.running:
+            self.running = False
+            #acquire conditional variable and wake up listenerThread run method.
+            with self.exit:
+                self.exit.notify_all()
+
+    def join(self, timeout):
+        """Join listener."""
+        self.listenerThread.join(timeout)
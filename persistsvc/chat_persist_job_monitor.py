@@ -1,71 +1,555 @@
 
+import datetime
 import logging
+import os
+import Queue
 import threading
 import time
 
+from sqlalchemy.sql import text
 from trpycore.thread.util import join
 from trpycore.thread.threadpool import ThreadPool
+from trpycore.timezone import tz
 from trsvcscore.db.models import ChatPersistJob
 
-from persister import ChatPersister
+from chat_persist_job_dispatcher import ChatPersistJobDispatcher
+from chat_persist_job_listener import ChatPersistJobListener
+from chat_persist_job_partitioner import ChatPersistJobPartitioner
+from persister import ChatPersister, ChatBatchPersister
+from topic_collection_cache import topic_collection_cache
 
 
 
+class ChatPersistJobPollInterval(object):
+    """Adaptive interval between chat persist job db scans.
+
+    The interval is reset to min_seconds whenever a scan finds work,
+    and is multiplied by backoff_factor, up to a maximum, after each
+    scan which finds nothing.
+    """
+    def __init__(self, min_seconds, backoff_factor=2):
+        """Constructor.
+
+        Arguments:
+            min_seconds: minimum number of seconds between scans
+            backoff_factor: factor by which to increase the
+                interval after each idle scan.
+        """
+        self.min_seconds = min_seconds
+        self.backoff_factor = backoff_factor
+        self.seconds = min_seconds
+
+    def reset(self):
+        """Reset the interval to the minimum."""
+        self.seconds = self.min_seconds
+
+    def backoff(self, max_seconds):
+        """Increase the interval following an idle scan.
+
+        Arguments:
+            max_seconds: maximum number of seconds between scans
+        """
+        self.seconds = min(max_seconds, max(
+            self.min_seconds,
+            self.seconds * self.backoff_factor))
+
+    def get(self):
+        """Return the number of seconds to wait before the next scan."""
+        return self.seconds
+
+
+class ChatPersistJobTracker(object):
+    """Thread-safe tracker of queued and in-flight chat persist jobs.
+
+    Jobs are added when they are put on the thread pool queue,
+    marked started when a worker thread picks them up, and
+    removed once processing completes.
+    """
+    def __init__(self, finish_callback=None):
+        """Constructor.
+
+        Arguments:
+            finish_callback: optional callable invoked with the
+                job id each time a job is completed.
+        """
+        self.finish_callback = finish_callback
+        self.lock = threading.Lock()
+        self.queued_job_ids = set()
+        self.running_job_ids = set()
+
+    def add(self, job_id):
+        """Add a queued job.
+
+        Arguments:
+            job_id: ChatPersistJob id
+        Returns:
+            True if the job was added, False if the job
+            is already queued or in-flight.
+        """
+        with self.lock:
+            if job_id in self.queued_job_ids or \
+               job_id in self.running_job_ids:
+                return False
+            self.queued_job_ids.add(job_id)
+            return True
+
+    def start(self, job_id):
+        """Mark a queued job as in-flight."""
+        with self.lock:
+            self.queued_job_ids.discard(job_id)
+            self.running_job_ids.add(job_id)
+
+    def finish(self, job_id):
+        """Remove a completed job."""
+        with self.lock:
+            self.queued_job_ids.discard(job_id)
+            self.running_job_ids.discard(job_id)
+        if self.finish_callback:
+            self.finish_callback(job_id)
+
+    def contains(self, job_id):
+        """Check if a job is queued or in-flight."""
+        with self.lock:
+            return job_id in self.queued_job_ids or \
+                job_id in self.running_job_ids
+
+    def get_queued_job_ids(self):
+        """Return a list of queued job ids."""
+        with self.lock:
+            return list(self.queued_job_ids)
+
+    def get_job_ids(self):
+        """Return a list of queued and in-flight job ids."""
+        with self.lock:
+            return list(self.queued_job_ids | self.running_job_ids)
+
+    def count(self):
+        """Return the number of queued and in-flight jobs."""
+        with self.lock:
+            return len(self.queued_job_ids) + len(self.running_job_ids)
+
+    def queued_count(self):
+        """Return the number of jobs waiting for a worker thread."""
+        with self.lock:
+            return len(self.queued_job_ids)
+
+    def running_count(self):
+        """Return the number of jobs being processed."""
+        with self.lock:
+            return len(self.running_job_ids)
+
+
 class ChatPersisterThreadPool(ThreadPool):
     """Thread pool used to process chat persist jobs.
 
     Given a work item (job_id), this class will process the
     job and delegate the work to persist the associated chat data to the db.
+
+    Jobs are held in a priority queue, ordered by (priority, created, job_id),
+    and a token is put on the underlying thread pool queue for each job.
+    Each worker thread that receives a token processes the highest priority
+    job waiting at that time, rather than the job that was queued first.
+    If batch_size is greater than 1, a worker thread takes up to
+    batch_size of the highest priority jobs waiting and persists them
+    together with a ChatBatchPersister. Tokens left over for jobs which
+    were taken as part of a batch are ignored.
+
+    The pool is resizable. max_threads worker threads are started, but
+    only 'size' of them may process jobs at once; the rest wait for a
+    free slot. The size may be changed at any time with resize().
     """
-    def __init__(self, num_threads, db_session_factory):
+
+    # Work item put on the thread pool queue for each job
+    JOB_TOKEN = "job"
+
+    def __init__(self, num_threads, db_session_factory, job_tracker, owner,
+            retry_attempts=3, retry_seconds=60, max_threads=None,
+            compute_pool=None, batch_size=1):
         """Constructor.
 
         Arguments:
-            num_threads: number of worker threads
+            num_threads: initial, and minimum, number of worker
+                threads processing jobs.
             db_session_factory: callable returning new sqlalchemy
                 db session.
+            job_tracker: ChatPersistJobTracker to be updated as
+                jobs are started and completed.
+            owner: owner of the claimed jobs
+            retry_attempts: maximum number of times to retry
+                a failed chat session.
+            retry_seconds: number of seconds to wait before
+                the first retry.
+            max_threads: maximum number of worker threads processing
+                jobs. Defaults to num_threads.
+            compute_pool: optional multiprocessing Pool in which
+                to process chat messages.
+            batch_size: maximum number of jobs each worker thread
+                persists at once.
         """
         self.log = logging.getLogger(__name__)
+        self.min_threads = num_threads
+        self.max_threads = max(num_threads, max_threads or num_threads)
+        self.size = num_threads
+        self.active = 0
+        self.slots = threading.Condition()
         self.db_session_factory = db_session_factory
-        super(ChatPersisterThreadPool, self).__init__(num_threads)
+        self.job_tracker = job_tracker
+        self.owner = owner
+        self.retry_attempts = retry_attempts
+        self.retry_seconds = retry_seconds
+        self.compute_pool = compute_pool
+        self.batch_size = batch_size
+        self.job_queue = Queue.PriorityQueue()
+        self.stopping = False
+        super(ChatPersisterThreadPool, self).__init__(self.max_threads)
 
-    def process(self, job_id):
+    def stop(self):
+        """Stop thread pool.
+
+        Jobs which have not been started will not be processed,
+        and remain queued in the job tracker to be released
+        by the caller.
+        """
+        with self.slots:
+            self.stopping = True
+            self.slots.notify_all()
+        super(ChatPersisterThreadPool, self).stop()
+
+    def is_stopped(self):
+        """Check if the pool is stopped and no jobs are being processed.
+
+        Once stopped, worker threads take no further jobs, so no
+        more work is handed to the compute pool.
+        """
+        with self.slots:
+            return self.stopping and not self.active
+
+    def get_size(self):
+        """Return the number of worker threads which may process jobs."""
+        return self.size
+
+    def resize(self, size):
+        """Resize the pool.
+
+        Arguments:
+            size: number of worker threads which may process jobs.
+                Limited to the range [min_threads, max_threads].
+        Returns:
+            new size of the pool.
+        """
+        with self.slots:
+            self.size = min(self.max_threads, max(self.min_threads, size))
+            self.slots.notify_all()
+            return self.size
+
+    def put_job(self, job_id, priority, created):
+        """Queue a job for processing.
+
+        Arguments:
+            job_id: ChatPersistJob id
+            priority: job priority. Lower values are processed first.
+            created: ChatPersistJob creation time. Older jobs of
+                the same priority are processed first.
+        """
+        self.job_queue.put((priority, created, job_id))
+        self.put(self.JOB_TOKEN)
+
+    def _get_job_ids(self):
+        """Take up to batch_size of the highest priority queued jobs.
+
+        Returns:
+            list of ChatPersistJob ids, which is empty if
+            the jobs were taken by other worker threads.
+        """
+        job_ids = []
+        while len(job_ids) < self.batch_size:
+            try:
+                priority, created, job_id = self.job_queue.get_nowait()
+            except Queue.Empty:
+                break
+            job_ids.append(job_id)
+        return job_ids
+
+    def process(self, token):
         """Worker thread process method.
 
         This method will be invoked by each worker thread when
-        a new work item (job_id) is put on the queue.
+        a new work item (job token) is put on the queue.
         """
+        # Wait for a free slot before taking the job,
+        # so the highest priority job is taken.
+        with self.slots:
+            while self.active >= self.size and not self.stopping:
+                self.slots.wait()
+            self.active += 1
 
-        persister = ChatPersister(self.db_session_factory, job_id)
-        persister.persist()
+        try:
+            # Jobs are taken under the slot lock, so none are started
+            # once stop() returns. Jobs left queued remain in the job
+            # tracker to be released by the caller.
+            with self.slots:
+                if self.stopping:
+                    return
+                job_ids = self._get_job_ids()
+                for job_id in job_ids:
+                    self.job_tracker.start(job_id)
+
+            try:
+                if len(job_ids) > 1:
+                    persister = ChatBatchPersister(
+                            self.db_session_factory,
+                            job_ids,
+                            self.owner,
+                            self.retry_attempts,
+                            self.retry_seconds,
+                            self.compute_pool)
+                    persister.persist()
+                elif job_ids:
+                    persister = ChatPersister(
+                            self.db_session_factory,
+                            job_ids[0],
+                            self.owner,
+                            self.retry_attempts,
+                            self.retry_seconds,
+                            self.compute_pool)
+                    persister.persist()
+            finally:
+                for job_id in job_ids:
+                    self.job_tracker.finish(job_id)
+        finally:
+            with self.slots:
+                self.active -= 1
+                self.slots.notify()
 
 
 class ChatPersistJobMonitor(object):
     """
     ChatPersistJobMonitor monitors for new chat persist jobs, and delegates
      work items to the ChatPersisterThreadPool.
+
+    Jobs are leased by the monitor, no more than its workers have
+    capacity for, before being delegated. If ZooKeeper is configured,
+    jobs are partitioned amongst, or dispatched to, the monitors.
     """
-    def __init__(self, num_threads, db_session_factory, poll_seconds=60):
+
+    # Job priorities. Lower values are processed first.
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_RERUN = 1
+
+    # Owner prefix of jobs claimed by the dispatch leader
+    # which are waiting in the work queue.
+    DISPATCH_OWNER_PREFIX = "dispatch:"
+
+    # Atomically claim up to :limit unclaimed or lease expired jobs of
+    # one priority lane, oldest first. Rows locked by a concurrent
+    # claim on another node are skipped rather than waited on, so
+    # claims never contend. Jobs for chat sessions which already have
+    # an earlier job (re-runs and retries) are in the rerun lane, and
+    # all others in the interactive lane. Each lane is claimed with its
+    # own statement, ordered by (created, id) alone, so the order may
+    # be read from an index rather than by sorting every unfinished
+    # job, given an index such as:
+    #     CREATE INDEX chat_persist_job_unfinished_idx
+    #         ON chat_persist_job (created, id)
+    #         WHERE "end" IS NULL AND successful IS NULL;
+    # The chat_persist_job schema is not managed by this service.
+    _CLAIM_JOBS_SQL = """
+        WITH claimable AS (
+            SELECT job.id, job.owner AS previous_owner
+            FROM chat_persist_job job
+            WHERE job."end" IS NULL AND job.successful IS NULL
+            AND ((job.owner IS NULL
+                    AND (job.start IS NULL OR job.start <= :start))
+                OR job.start < :lease_expired)
+            AND (:all_buckets
+                OR job.chat_session_id %% :num_buckets = ANY(:buckets))
+            AND %s EXISTS (
+                SELECT 1 FROM chat_persist_job prior
+                WHERE prior.chat_session_id = job.chat_session_id
+                AND prior.id < job.id)
+            ORDER BY job.created, job.id
+            LIMIT :limit
+            FOR UPDATE OF job SKIP LOCKED)
+        UPDATE chat_persist_job SET owner=:owner, start=:start
+        FROM claimable
+        WHERE chat_persist_job.id = claimable.id
+        RETURNING chat_persist_job.id, chat_persist_job.created,
+            claimable.previous_owner"""
+    CLAIM_INTERACTIVE_JOBS_SQL = text(_CLAIM_JOBS_SQL % "NOT")
+    CLAIM_RERUN_JOBS_SQL = text(_CLAIM_JOBS_SQL % "")
+
+    # (priority, claim statement) of each lane, in the order claimed
+    CLAIM_LANES = [
+        (PRIORITY_INTERACTIVE, CLAIM_INTERACTIVE_JOBS_SQL),
+        (PRIORITY_RERUN, CLAIM_RERUN_JOBS_SQL)
+    ]
+
+    # Hand off dispatched jobs taken from the work queue. Jobs which
+    # were reclaimed after their dispatch lease expired, and so may
+    # already have been taken, are skipped.
+    TAKE_JOBS_SQL = text("""
+        UPDATE chat_persist_job SET owner=:owner, start=:start
+        WHERE id = ANY(:job_ids)
+        AND "end" IS NULL AND successful IS NULL
+        AND owner LIKE :dispatch_owner
+        RETURNING id, created""")
+
+    # Renew the lease on owned, unfinished jobs. Rows locked by a
+    # worker thread, which is ending or aborting the job in a
+    # transaction that may hold the lock until a whole batch
+    # commits, are skipped rather than waited on, so the monitor
+    # thread never blocks on them. A locked job can not be
+    # reclaimed, since claims skip locked rows too.
+    RENEW_LEASES_SQL = text("""
+        UPDATE chat_persist_job SET start=:start
+        WHERE id IN (
+            SELECT id FROM chat_persist_job
+            WHERE id = ANY(:job_ids)
+            AND owner = :owner
+            AND "end" IS NULL
+            FOR UPDATE SKIP LOCKED)""")
+
+    def __init__(self, num_threads, db_session_factory, hostname, poll_seconds=60,
+            notify_channel=None, notify_poll_seconds=600, prefetch=2,
+            min_poll_seconds=1, lease_seconds=300, zookeeper_client=None,
+            partition_path=None, partition_buckets=64, dispatch_path=None,
+            dispatch_queue_size=100, retry_attempts=3, retry_seconds=60,
+            max_threads=None, compute_pool=None, batch_size=1):
         """Constructor.
 
         Arguments:
-            num_threads: number of worker threads
+            num_threads: minimum number of worker threads
             db_session_factory: callable returning a new sqlalchemy db session
-            poll_seconds: number of seconds between db queries to detect
-                chat requiring scheduling.
+            hostname: name of the host running the monitor. Jobs are
+                claimed with an owner of the form hostname:pid:thread,
+                where the hostname is truncated so that owners fit
+                within ChatPersister.OWNER_MAX_LENGTH.
+            poll_seconds: maximum number of seconds between db queries
+                to detect chat requiring scheduling.
+            notify_channel: optional name of the db notification channel
+                on which new chat persist jobs are announced. If provided,
+                the monitor scans for jobs as soon as a notification is
+                received, and only falls back to polling every
+                poll_seconds while the listen connection is down.
+            notify_poll_seconds: maximum number of seconds between db
+                queries while the listen connection is up. This is a
+                safety net for missed notifications.
+            prefetch: number of jobs to claim, in addition to the
+                number of free worker threads, so that workers
+                do not sit idle waiting for the next db scan.
+            min_poll_seconds: minimum number of seconds between db
+                queries, used while jobs are being found.
+            lease_seconds: number of seconds a claim remains valid
+                without being renewed. Leases are renewed every
+                third of this interval.
+            zookeeper_client: optional ZookeeperClient used to partition
+                jobs across monitors. Must be started before the monitor.
+            partition_path: ZooKeeper path of the partition group
+            partition_buckets: number of buckets jobs are partitioned
+                into. Must be the same for all monitors in the group.
+            dispatch_path: optional ZooKeeper path of the dispatch group.
+                If provided, along with zookeeper_client, jobs are
+                dispatched by an elected leader rather than partitioned.
+            dispatch_queue_size: maximum number of jobs the leader
+                publishes to the work queue ahead of consumers.
+            retry_attempts: maximum number of times to retry a
+                failed chat session before giving up.
+            retry_seconds: number of seconds to wait before the first
+                retry of a failed job. Doubled for each retry.
+            max_threads: maximum number of worker threads. Defaults
+                to num_threads, which disables resizing.
+            compute_pool: optional multiprocessing Pool in which to
+                process chat messages. If None, chat messages are
+                processed in the worker threads. The pool must be
+                created before the service starts any threads, since
+                its worker processes are forked. The monitor
+                terminates the pool once stopped and joined.
+            batch_size: maximum number of jobs persisted by a
+                worker thread in a single db transaction.
         """
         self.log = logging.getLogger(__name__)
-        self.num_threads = num_threads
         self.db_session_factory = db_session_factory
         self.poll_seconds = poll_seconds
+        self.notify_poll_seconds = notify_poll_seconds
+        self.prefetch = prefetch
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = lease_seconds / 3.0
+        self.last_heartbeat = 0
+        self.poll_interval = ChatPersistJobPollInterval(min_poll_seconds)
         self.monitorThread = threading.Thread(target=self.run)
-        self.threadpool = ChatPersisterThreadPool(num_threads, db_session_factory)
+        self.owner = self._get_owner(hostname)
+        self.job_tracker = ChatPersistJobTracker(self._job_finished)
+
+        self.compute_pool = compute_pool
 
-        #conditional variable allowing speedy wakeup on exit.
+        self.threadpool = ChatPersisterThreadPool(
+                num_threads,
+                db_session_factory,
+                self.job_tracker,
+                self.owner,
+                retry_attempts,
+                retry_seconds,
+                max_threads,
+                self.compute_pool,
+                batch_size)
+        self.threadpool_grow_count = 0
+        self.threadpool_shrink_count = 0
+
+        self.listener = None
+        if notify_channel:
+            self.listener = ChatPersistJobListener(
+                    db_session_factory,
+                    notify_channel,
+                    self.wakeup)
+
+        self.dispatch_owner = self.DISPATCH_OWNER_PREFIX + self.owner
+        self.dispatch_queue_size = dispatch_queue_size
+        self.dispatcher = None
+        if zookeeper_client and dispatch_path:
+            self.dispatcher = ChatPersistJobDispatcher(
+                    zookeeper_client,
+                    dispatch_path,
+                    self.owner,
+                    self.wakeup)
+
+        self.partitioner = None
+        if zookeeper_client and partition_path and not self.dispatcher:
+            self.partitioner = ChatPersistJobPartitioner(
+                    zookeeper_client,
+                    partition_path,
+                    self.owner,
+                    partition_buckets,
+                    self.wakeup)
+
+        #conditional variable allowing speedy wakeup on exit
+        #and when new jobs are announced.
         self.exit = threading.Condition()
+        self.scan_requested = False
+
+        # Indicates that the last scan was limited by worker
+        # capacity, so more jobs are likely waiting in the db.
+        self.backlog = False
 
         self.running = False
 
+    def _get_owner(self, hostname):
+        """Get the owner of the jobs claimed by this monitor.
+
+        The pid and thread name, which make the owner unique, are
+        kept whole, and the hostname is truncated so the owner still
+        fits within ChatPersister.OWNER_MAX_LENGTH once prefixed with
+        DISPATCH_OWNER_PREFIX.
+
+        Arguments:
+            hostname: name of the host running the monitor
+        Returns:
+            owner string of the form hostname:pid:thread
+        """
+        suffix = ":%d:%s" % (os.getpid(), self.monitorThread.name)
+        max_length = ChatPersister.OWNER_MAX_LENGTH - len(self.DISPATCH_OWNER_PREFIX)
+        return hostname[:max(0, max_length - len(suffix))] + suffix
+
     def create_db_session(self):
         """Create new sqlalchemy db session.
 
@@ -78,61 +562,428 @@ class ChatPersistJobMonitor(object):
         """Start persister."""
         if not self.running:
             self.running = True
+            if self.dispatcher:
+                self.dispatcher.start()
+            if self.partitioner:
+                self.partitioner.start()
             self.threadpool.start()
             self.monitorThread.start()
+            if self.listener:
+                self.listener.start()
+
+    def wakeup(self):
+        """Request an immediate scan for new jobs."""
+        with self.exit:
+            self.scan_requested = True
+            self.exit.notify_all()
+
+    def _job_finished(self, job_id):
+        """Job tracker finish callback.
+
+        Wakes up the monitor to claim more work, if
+        there is a backlog of jobs waiting in the db.
+        """
+        if self.backlog:
+            self.wakeup()
+
+    def _get_poll_seconds(self):
+        """Get the maximum number of seconds to wait between db scans.
+
+        Returns:
+            notify_poll_seconds if notifications are being received,
+            poll_seconds otherwise.
+        """
+        if self.listener and self.listener.is_connected():
+            return self.notify_poll_seconds
+        return self.poll_seconds
+
+    def get_counters(self):
+        """Get monitor counters.
+
+        Returns:
+            dict of counter name to integer value.
+        """
+        counters = {
+            "persist_jobs_queued": self.job_tracker.queued_count(),
+            "persist_jobs_running": self.job_tracker.running_count(),
+            "persist_threads": self.threadpool.get_size(),
+            "persist_threadpool_grow_count": self.threadpool_grow_count,
+            "persist_threadpool_shrink_count": self.threadpool_shrink_count
+        }
+        if self.dispatcher:
+            counters["persist_dispatch_leader"] = int(self.dispatcher.is_leader())
+        counters.update(topic_collection_cache.get_counters())
+        return counters
+
+    def _get_claim_limit(self):
+        """Get the number of jobs which may be claimed.
+
+        Returns:
+            number of worker threads, times the batch size, plus
+            prefetch, less the number of jobs already queued or
+            in-flight.
+        """
+        capacity = self.threadpool.get_size() * self.batch_size + self.prefetch
+        return max(0, capacity - self.job_tracker.count())
+
+    def _resize_threadpool(self):
+        """Resize the thread pool to match the backlog.
+
+        Grows the pool by the number of waiting jobs if every
+        worker is busy, and shrinks it by one thread if any
+        worker is idle and no jobs are waiting.
+        """
+        size = self.threadpool.get_size()
+        queued = self.job_tracker.queued_count()
+        running = self.job_tracker.running_count()
+
+        new_size = size
+        if queued and running >= size:
+            new_size = self.threadpool.resize(size + queued)
+        elif not queued and running < size:
+            new_size = self.threadpool.resize(size - 1)
+
+        if new_size > size:
+            self.threadpool_grow_count += 1
+            self.log.info("Grew chat persister thread pool from %d to %d threads." % (size, new_size))
+        elif new_size < size:
+            self.threadpool_shrink_count += 1
+            self.log.info("Shrunk chat persister thread pool from %d to %d threads." % (size, new_size))
+
+    def _dispatch(self, job_id, priority, created):
+        """Delegate a claimed job to the threadpool for processing.
+
+        Jobs which are already queued or in-flight are skipped.
+        """
+        if self.job_tracker.add(job_id):
+            self.threadpool.put_job(job_id, priority, created)
+        else:
+            self.log.info("Chat persist job with job_id=%d already queued." % job_id)
+
+    def _claim_jobs(self, session, limit, owner=None):
+        """Claim unclaimed chat persist jobs.
+
+        Marks up to limit ChatPersistJobs with no owner and no start
+        time, or a retry start time which has passed, as started by
+        updating the 'owner' field and the 'start' field in a single
+        statement. Unfinished jobs whose lease has expired, because
+        the owning node died, are reclaimed.
+
+        Jobs are claimed oldest first. Jobs for chat sessions which
+        already have an earlier persist job (re-runs and retries) are
+        placed in a lower priority lane, which is only claimed from
+        once the interactive lane is exhausted, so newly finished
+        chats are never stuck behind them. If jobs are partitioned, only jobs
+        in this monitor's buckets are claimed, or all jobs until the
+        partition is known.
+
+        Arguments:
+            session: sqlalchemy db session
+            limit: maximum number of jobs to claim
+            owner: optional owner of the claimed jobs. Defaults
+                to this monitor.
+        Returns:
+            list of claimed (job_id, priority, created) tuples
+            ordered by priority and then creation time. The claim
+            is not visible to other sessions until session is committed.
+        """
+        buckets = None
+        num_buckets = 1
+        if self.partitioner:
+            buckets = self.partitioner.get_buckets()
+            num_buckets = self.partitioner.num_buckets
+
+        now = tz.utcnow()
+        jobs = []
+        for priority, claim_jobs_sql in self.CLAIM_LANES:
+            if len(jobs) >= limit:
+                break
+
+            result = session.execute(claim_jobs_sql, {
+                "owner": owner or self.owner,
+                "start": now,
+                "lease_expired": now - datetime.timedelta(seconds=self.lease_seconds),
+                "limit": limit - len(jobs),
+                "all_buckets": buckets is None,
+                "num_buckets": num_buckets,
+                "buckets": buckets or []
+            })
+
+            for row in result:
+                if row.previous_owner is not None:
+                    self.log.warning("Reclaiming chat persist job with job_id=%d from owner=%s after lease expired." \
+                            % (row.id, row.previous_owner))
+                jobs.append((row.id, priority, row.created))
+
+        jobs.sort(key=lambda job: (job[1], job[2], job[0]))
+        return jobs
+
+    def _publish_jobs(self, session):
+        """Claim jobs on behalf of the dispatch group and publish
+        them to the work queue.
+
+        Only called on the dispatch leader. The claim is committed
+        before the jobs are published so consumers can take them.
+
+        Arguments:
+            session: sqlalchemy db session
+        Returns:
+            number of jobs published.
+        """
+        limit = self.dispatch_queue_size - self.dispatcher.queue_size()
+        if limit <= 0:
+            return 0
+
+        jobs = self._claim_jobs(session, limit, self.dispatch_owner)
+        session.commit()
+        if jobs:
+            self.dispatcher.publish(jobs)
+            self.log.info("ChatPersistJobMonitor dispatched %d new jobs" % len(jobs))
+        return len(jobs)
+
+    def _take_jobs(self, session, limit):
+        """Take dispatched jobs from the work queue.
+
+        Jobs removed from the work queue are handed off to this
+        monitor by updating their 'owner' and 'start' fields.
+        Jobs which are removed from the queue but never handed
+        off, because this monitor died, are reclaimed by the
+        leader once their dispatch lease expires.
+
+        Arguments:
+            session: sqlalchemy db session
+            limit: maximum number of jobs to take
+        Returns:
+            list of taken (job_id, priority, created) tuples
+            ordered by priority and then creation time.
+        """
+        priorities = dict(self.dispatcher.take(limit))
+        if not priorities:
+            return []
+
+        result = session.execute(self.TAKE_JOBS_SQL, {
+            "owner": self.owner,
+            "start": tz.utcnow(),
+            "job_ids": priorities.keys(),
+            "dispatch_owner": self.DISPATCH_OWNER_PREFIX + "%"
+        })
+
+        jobs = [(row.id, priorities[row.id], row.created) for row in result]
+        jobs.sort(key=lambda job: (job[1], job[2], job[0]))
+        return jobs
+
+    def _renew_dispatch_leases(self, session):
+        """Renew the lease on jobs waiting in the work queue.
+
+        Only called on the dispatch leader. Jobs published by a
+        previous leader are renewed as well.
+
+        Arguments:
+            session: sqlalchemy db session
+        """
+        job_ids = self.dispatcher.get_queued_job_ids()
+        if job_ids:
+            session.query(ChatPersistJob).\
+                filter(ChatPersistJob.id.in_(job_ids)).\
+                filter(ChatPersistJob.owner.like(self.DISPATCH_OWNER_PREFIX + "%")).\
+                filter(ChatPersistJob.end == None).\
+                update({
+                    ChatPersistJob.start: tz.utcnow()
+                }, synchronize_session=False)
+
+    def _renew_leases(self, session):
+        """Renew the lease on all queued and in-flight jobs.
+
+        The 'start' field of claimed jobs is updated, as a
+        heartbeat, so the claims do not expire while the jobs
+        are waiting or being processed.
+        Jobs locked by a worker thread are skipped
+        (see RENEW_LEASES_SQL).
+
+        Arguments:
+            session: sqlalchemy db session
+        """
+        job_ids = self.job_tracker.get_job_ids()
+        if job_ids:
+            result = session.execute(self.RENEW_LEASES_SQL, {
+                "start": tz.utcnow(),
+                "job_ids": job_ids,
+                "owner": self.owner
+            })
+
+            if result.rowcount < len(job_ids):
+                self.log.info("Skipped renewing lease on %d locked or no longer owned chat persist jobs." % \
+                        (len(job_ids) - result.rowcount))
+
+    def _release_jobs(self, job_ids):
+        """Release claimed jobs so they may be claimed by other nodes.
+
+        Arguments:
+            job_ids: list of ChatPersistJob ids to release
+        """
+        session = self.create_db_session()
+        try:
+            num_rows_updated = session.query(ChatPersistJob).\
+                filter(ChatPersistJob.id.in_(job_ids)).\
+                filter(ChatPersistJob.owner == self.owner).\
+                filter(ChatPersistJob.end == None).\
+                update({
+                    ChatPersistJob.owner: None,
+                    ChatPersistJob.start: None
+                }, synchronize_session=False)
+            session.commit()
+            self.log.info("Released %d unprocessed chat persist jobs." % num_rows_updated)
+        except Exception as error:
+            session.rollback()
+            self.log.exception(error)
+        finally:
+            session.close()
 
     def run(self):
-        """Monitor thread run method."""
+        """Monitor thread run method.
+
+        The time between scans adapts to the backlog. While scans
+        keep returning full batches the monitor re-scans as soon as
+        workers have capacity, and while scans return nothing the
+        interval backs off towards the poll interval.
+
+        If jobs are dispatched, only the elected leader scans the db,
+        publishing the jobs it claims to a ZooKeeper work queue, and
+        every monitor takes jobs from the queue as it has capacity.
+        """
         session = self.create_db_session()
 
         while self.running:
+            with self.exit:
+                self.scan_requested = False
+
+            wait_seconds = self.poll_interval.get()
+
             try:
-                self.log.info("ChatPersistJobMonitor is checking for new jobs to process...")
+                # Renew leases on our jobs before they expire
+                if time.time() - self.last_heartbeat >= self.heartbeat_seconds:
+                    self._renew_leases(session)
+                    if self.dispatcher and self.dispatcher.is_leader():
+                        self._renew_dispatch_leases(session)
+                    self.last_heartbeat = time.time()
 
-                # Look for ChatPersistJobs with no owner and no start time.
-                # This indicates a job which needs to be processed.
-                for job in session.query(ChatPersistJob).\
-                    filter(ChatPersistJob.owner == None).\
-                    filter(ChatPersistJob.start == None):
+                self.log.debug("ChatPersistJobMonitor is checking for new jobs to process...")
 
-                    # delegate jobs to threadpool for processing
-                    self.threadpool.put(job.id)
+                # Claim ChatPersistJobs with no owner and no start time.
+                # This indicates a job which needs to be processed.
+                # Only claim as many jobs as we have capacity for.
+                jobs = []
+                published = 0
+                claim_limit = self._get_claim_limit()
+                if self.dispatcher:
+                    # Only the leader scans the db. All monitors
+                    # take jobs from the work queue.
+                    if self.dispatcher.is_leader():
+                        published = self._publish_jobs(session)
+                    if claim_limit:
+                        jobs = self._take_jobs(session, claim_limit)
+                elif claim_limit:
+                    jobs = self._claim_jobs(session, claim_limit)
 
-                # commit is required so changes to db will be
-                # reflected (MVCC).
+                # commit is required to persist the claim, and
+                # so changes to db will be reflected (MVCC).
                 session.commit()
 
+                # delegate claimed jobs to threadpool for processing
+                for job_id, priority, created in jobs:
+                    self._dispatch(job_id, priority, created)
+
+                self._resize_threadpool()
+
+                # A full batch (or no capacity to claim a batch) indicates
+                # more jobs are likely waiting. Re-scan immediately if
+                # workers still have capacity, otherwise wait for a
+                # worker to finish.
+                self.backlog = not claim_limit or len(jobs) == claim_limit
+                if jobs or published:
+                    if jobs:
+                        self.log.info("ChatPersistJobMonitor claimed %d new jobs to process" % len(jobs))
+                    self.poll_interval.reset()
+                    wait_seconds = self.poll_interval.get()
+                    if self.backlog and self._get_claim_limit():
+                        wait_seconds = 0
+                elif claim_limit:
+                    self.poll_interval.backoff(self._get_poll_seconds())
+                    wait_seconds = self.poll_interval.get()
+
             except Exception as error:
                 session.rollback()
                 self.log.exception(error)
+                self.poll_interval.backoff(self._get_poll_seconds())
+                wait_seconds = self.poll_interval.get()
 
             finally:
                 session.close()
 
+            # Wake up in time to renew leases on queued and in-flight jobs
+            if self.job_tracker.count():
+                wait_seconds = min(wait_seconds, self.heartbeat_seconds)
+
             # Acquire exit conditional variable
             # and call wait on this to sleep the
             # necessary time between db checks.
             # Waiting on a conditional variable,
             # allows the wait to be interrupted
-            # when stop() is called.
+            # when stop() is called or a new job
+            # notification is received.
             with self.exit:
-                end = time.time() + self.poll_seconds
+                end = time.time() + wait_seconds
                 #wait in loop, rechecking condition,
                 #to combate spurious wakeups.
-                while self.running and (time.time() < end):
+                while self.running and not self.scan_requested \
+                        and (time.time() < end):
                     remaining_wait = end - time.time()
                     self.exit.wait(remaining_wait)
 
+        # Release jobs which were claimed but not started so other
+        # nodes don't have to wait for the lease to expire. This is
+        # done once the loop has exited, so no more jobs are claimed,
+        # and after stopping the thread pool, so no more are started
+        # and none are released while running.
+        self.threadpool.stop()
+        queued_job_ids = self.job_tracker.get_queued_job_ids()
+        if queued_job_ids:
+            self._release_jobs(queued_job_ids)
+
     def stop(self):
-        """Stop persister."""
+        """Stop persister.
+
+        The monitor thread stops the thread pool, and releases
+        the jobs which are still queued, once it exits.
+        """
         if self.running:
             self.running = False
             #acquire conditional variable and wake up monitorThread run method.
             with self.exit:
                 self.exit.notify_all()
-            self.threadpool.stop()
+            if self.listener:
+                self.listener.stop()
+            if self.dispatcher:
+                self.dispatcher.stop()
+            if self.partitioner:
+                self.partitioner.stop()
 
     def join(self, timeout):
         """Join persister."""
-        join([self.threadpool, self.monitorThread], timeout)
+        threads = [self.threadpool, self.monitorThread]
+        if self.listener:
+            threads.append(self.listener)
+        join(threads, timeout)
+
+        # Only the worker threads hand work to the worker processes,
+        # so none remains once the monitor is stopped and the worker
+        # threads are done. join() is called periodically while the
+        # service runs, so the processes are left alone until then.
+        # They are terminated, rather than waited on, since Pool.join()
+        # has no timeout.
+        if self.compute_pool and not self.running and \
+                self.threadpool.is_stopped():
+            self.compute_pool.terminate()
+            self.compute_pool.join()
+            self.compute_pool = None
 
@@ -0,0 +1,200 @@
+import bisect
+import hashlib
+import logging
+import threading
+
+import zookeeper
+
+
+class ConsistentHashRing(object):
+    """Consistent hash ring.
+
+    Maps keys to members such that adding or removing a
+    member only remaps the keys belonging to that member.
+    Each member is placed on the ring multiple times
+    (replicas) to spread keys evenly across members.
+    """
+    def __init__(self, members=None, replicas=100):
+        """Constructor.
+
+        Arguments:
+            members: optional list of member names
+            replicas: number of points on the ring per member
+        """
+        self.replicas = replicas
+        self.hashes = []
+        self.hash_members = {}
+        for member in members or []:
+            self.add(member)
+
+    def _hash(self, key):
+        """Hash a key to a point on the ring."""
+        return long(hashlib.md5(str(key)).hexdigest()[:16], 16)
+
+    def add(self, member):
+        """Add member to the ring."""
+        for replica in range(self.replicas):
+            point = self._hash("%s:%d" % (member, replica))
+            if point not in self.hash_members:
+                bisect.insort(self.hashes, point)
+            self.hash_members[point] = member
+
+    def remove(self, member):
+        """Remove member from the ring."""
+        for replica in range(self.replicas):
+            point = self._hash("%s:%d" % (member, replica))
+            if self.hash_members.get(point) == member:
+                del self.hash_members[point]
+                self.hashes.remove(point)
+
+    def get(self, key):
+        """Get the member responsible for key.
+
+        Returns:
+            member name, or None if the ring is empty.
+        """
+        if not self.hashes:
+            return None
+        index = bisect.bisect(self.hashes, self._hash(key)) % len(self.hashes)
+        return self.hash_members[self.hashes[index]]
+
+
+class ChatPersistJobPartitioner(object):
+    """
+    ChatPersistJobPartitioner partitions chat persist jobs across
+    service instances using ZooKeeper group membership.
+
+    Jobs are split into num_buckets buckets by chat_session_id
+    (chat_session_id % num_buckets), and buckets are assigned to
+    group members with a consistent hash ring, so that a member
+    joining or leaving only moves that member's buckets.
+
+    Each instance registers an ephemeral sequential node under
+    <path>/members and watches the members node for changes.
+    ZooKeeper watches only flag the membership as stale, since
+    synchronous ZooKeeper calls can not be made from the watch
+    callback; the membership is re-read on the next call
+    to get_buckets().
+    """
+    def __init__(self, zookeeper_client, path, member_data, num_buckets=64,
+            change_callback=None):
+        """Constructor.
+
+        Arguments:
+            zookeeper_client: started ZookeeperClient
+            path: ZooKeeper path for the partition group
+            member_data: data to store in this instance's member node
+                identifying the instance.
+            num_buckets: number of buckets to split jobs into. This
+                must be the same for all instances.
+            change_callback: optional callable invoked with no arguments
+                when the group membership changes.
+        """
+        self.log = logging.getLogger(__name__)
+        self.zookeeper_client = zookeeper_client
+        self.path = path
+        self.members_path = "%s/members" % path
+        self.member_data = member_data
+        self.num_buckets = num_buckets
+        self.change_callback = change_callback
+        self.lock = threading.Lock()
+        self.member_node = None
+        self.buckets = None
+        self.stale = True
+        self.running = False
+
+    def start(self):
+        """Start partitioner and join the group."""
+        if not self.running:
+            self.running = True
+            self.stale = True
+            self.get_buckets()
+
+    def stop(self):
+        """Stop partitioner and leave the group."""
+        if self.running:
+            self.running = False
+            with self.lock:
+                if self.member_node is not None:
+                    try:
+                        self.zookeeper_client.delete(
+                                "%s/%s" % (self.members_path, self.member_node))
+                    except Exception as error:
+                        self.log.exception(error)
+                    self.member_node = None
+                self.buckets = None
+
+    def get_buckets(self):
+        """Get the buckets owned by this instance.
+
+        Re-reads the group membership if it has changed.
+
+        Returns:
+            sorted list of owned buckets, or None if the
+            membership is not known, in which case all
+            jobs should be considered.
+        """
+        with self.lock:
+            if self.running and self.stale:
+                try:
+                    self._refresh()
+                except Exception as error:
+                    self.stale = True
+                    self.log.exception(error)
+            return self.buckets
+
+    def _ensure_path(self, path):
+        """Create path and any missing parent nodes."""
+        current_path = ""
+        for node in path.strip("/").split("/"):
+            current_path = "%s/%s" % (current_path, node)
+            if not self.zookeeper_client.exists(current_path):
+                try:
+                    self.zookeeper_client.create(current_path)
+                except zookeeper.NodeExistsException:
+                    pass
+
+    def _register(self):
+        """Create this instance's ephemeral member node if needed.
+
+        Returns:
+            name of this instance's member node.
+        """
+        if self.member_node is None or not self.zookeeper_client.exists(
+                "%s/%s" % (self.members_path, self.member_node)):
+            self._ensure_path(self.members_path)
+            node_path = self.zookeeper_client.create(
+                    "%s/member-" % self.members_path,
+                    self.member_data,
+                    sequence=True,
+                    ephemeral=True)
+            self.member_node = node_path.rsplit("/", 1)[-1]
+            self.log.info("Joined chat persist job partition group as %s" % self.member_node)
+        return self.member_node
+
+    def _refresh(self):
+        """Re-read the group membership and reassign buckets."""
+        # Clear stale flag before reading members, with the watch
+        # set, so that changes during the refresh are not missed.
+        self.stale = False
+        member_node = self._register()
+        members = self.zookeeper_client.get_children(
+                self.members_path,
+                watcher=self._on_members_changed)
+        if member_node not in members:
+            members.append(member_node)
+
+        ring = ConsistentHashRing(members)
+        buckets = [bucket for bucket in range(self.num_buckets)
+                if ring.get(bucket) == member_node]
+
+        if buckets != self.buckets:
+            self.log.info("Chat persist job partition rebalanced: %d members, %d of %d buckets owned" \
+                    % (len(members), len(buckets), self.num_buckets))
+        self.buckets = buckets
+
+    def _on_members_changed(self, event):
+        """ZooKeeper watch callback for group membership changes."""
+        self.stale = True
+        if self.running and self.change_callback:
+            self.change_callback()
@@ -0,0 +1,111 @@
+import logging
+import threading
+
+from trsvcscore.db.models import ChatMessageFormatType, ChatMessageType
+
+
+class LookupCache(object):
+    """
+    LookupCache caches the ids of lookup table rows by name.
+
+    Lookup tables, such as ChatMessageFormatType, hold reference
+    data which does not change while the service is running, so
+    their ids are read once, when first needed or when the cache is
+    loaded, rather than on every job. The cache is thread-safe and
+    is shared by all jobs in the process.
+    """
+    def __init__(self, models):
+        """Constructor.
+
+        Arguments:
+            models: list of lookup table model classes to cache.
+                Each must have 'id' and 'name' columns.
+        """
+        self.log = logging.getLogger(__name__)
+        self.models = models
+        self.lock = threading.Lock()
+        self.ids = None
+
+    def load(self, db_session):
+        """Load, or reload, all lookup tables.
+
+        Arguments:
+            db_session: sqlalchemy db session
+        """
+        ids = {}
+        for model in self.models:
+            ids[model] = dict(db_session.query(model.name, model.id).all())
+        with self.lock:
+            self.ids = ids
+
+    def get_id(self, db_session, model, name):
+        """Get the id of a lookup table row.
+
+        The cache is loaded if it has not been already, and is
+        reloaded once if the row is not found, in case it was
+        added since the cache was loaded.
+
+        Arguments:
+            db_session: sqlalchemy db session used to load the cache
+            model: lookup table model class
+            name: name of the row
+        Returns:
+            id of the row
+        Throws:
+            KeyError if the row does not exist.
+        """
+        return self.get_ids(db_session, model, [name])[0]
+
+    def get_ids(self, db_session, model, names):
+        """Get the ids of lookup table rows.
+
+        Arguments:
+            db_session: sqlalchemy db session used to load the cache
+            model: lookup table model class
+            names: list of row names
+        Returns:
+            list of row ids in the same order as names.
+        Throws:
+            KeyError if any of the rows do not exist.
+        """
+        with self.lock:
+            ids = self.ids
+
+        if ids is None or not set(names).issubset(ids[model]):
+            self.log.info("Loading lookup cache ...")
+            self.load(db_session)
+            with self.lock:
+                ids = self.ids
+
+        return [ids[model][name] for name in names]
+
+    def get_existing_ids(self, db_session, model, names):
+        """Get the ids of those lookup table rows which exist.
+
+        Unlike get_ids(), the cache is not reloaded when rows are
+        not found, so names which are never added do not cause a
+        reload on every call. Rows added since the cache was loaded
+        are found once it is reloaded with load().
+
+        Arguments:
+            db_session: sqlalchemy db session used to load the cache
+            model: lookup table model class
+            names: list of row names
+        Returns:
+            list of the ids of the rows which exist, in the same
+            order as names.
+        """
+        with self.lock:
+            ids = self.ids
+
+        if ids is None:
+            self.log.info("Loading lookup cache ...")
+            self.load(db_session)
+            with self.lock:
+                ids = self.ids
+
+        return [ids[model][name] for name in names if name in ids[model]]
+
+
+# Process-wide cache of the lookup tables used by the persister
+lookup_cache = LookupCache([ChatMessageFormatType, ChatMessageType])
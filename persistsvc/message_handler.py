@@ -8,8 +8,6 @@ from persistsvc_exceptions import \
     TagIdDoesNotExistException, \
     TopicIdDoesNotExistException
 from trchatsvc.gen.ttypes import MessageType, MarkerType
-from trsvcscore.db.models import ChatMinute, ChatSpeakingMarker,\
-    ChatTag
 from trpycore.timezone import tz
 
 
@@ -20,9 +18,16 @@ class MessageHandler(object):
     The concrete ChatMessageHandler class processes all ChatMessages
     and delegates to specific handlers that implement this
     interface.
+
+    Concrete handlers list the types of message they consume
+    in MESSAGE_TYPES, along with the method each is passed to.
     """
     __metaclass__ = abc.ABCMeta
 
+    # Thrift MessageTypes consumed by the handler, mapped
+    # to the name of the method which processes them.
+    MESSAGE_TYPES = {}
+
     def __init__(
             self,
             chat_message_handler):
@@ -121,15 +126,43 @@ class ChatMessageHandler(object):
         self.topics_collection = topics_collection
 
         # Create handlers for each type of message we need to persist
-        self.chat_marker_handler = ChatMarkerHandler(self)
-        self.chat_minute_handler = ChatMinuteHandler(self)
-        self.chat_tag_handler = ChatTagHandler(self)
+        handlers = dict((handler_class, handler_class(self))
+                        for handler_class in self.get_handler_classes())
+        self.chat_marker_handler = handlers[ChatMarkerHandler]
+        self.chat_minute_handler = handlers[ChatMinuteHandler]
+        self.chat_tag_handler = handlers[ChatTagHandler]
+
+        # Initialize handlers, and map each message type
+        # to the handler method listed in MESSAGE_TYPES.
+        self.message_handlers = {}
+        for handler_class in self.get_handler_classes():
+            handler = handlers[handler_class]
+            handler.initialize()
+            for message_type, method_name in handler.MESSAGE_TYPES.items():
+                self.message_handlers[message_type] = getattr(handler, method_name)
+
+    @staticmethod
+    def get_handler_classes():
+        """
+            Returns the MessageHandler classes used to process
+            chat messages, in initialization order.
+        """
+        return [ChatMarkerHandler, ChatMinuteHandler, ChatTagHandler]
 
-        # Initialize handlers
-        self.chat_marker_handler.initialize()
-        self.chat_minute_handler.initialize()
-        self.chat_tag_handler.initialize()
+    @staticmethod
+    def get_message_types():
+        """
+            Returns the Thrift MessageTypes consumed by the handlers.
+            Messages of any other type are ignored by process(),
+            so they need not be read.
 
+            Returns:
+                Sorted list of MessageType values.
+        """
+        message_types = set()
+        for handler_class in ChatMessageHandler.get_handler_classes():
+            message_types.update(handler_class.MESSAGE_TYPES)
+        return sorted(message_types)
 
     def finalize(self):
         """
@@ -148,7 +181,8 @@ class ChatMessageHandler(object):
     def process(self, message):
         """
             Converts input deserialized Thrift Message to a model instance(s)
-            based upon the chat message's type.
+            based upon the chat message's type, by passing it to the
+            handler method listed in the handlers' MESSAGE_TYPES.
 
             This method is the orchestrator of persisting all the chat entities
             that need to be stored from a chat.  Chat messages should be
@@ -166,25 +200,11 @@ class ChatMessageHandler(object):
 
         """
         try:
-            if message.header.type == MessageType.MINUTE_CREATE:
-                self.log.debug('handling minute create message id=%s' % message.minuteCreateMessage.minuteId)
-                self.chat_minute_handler.create_models(message)
-
-            elif message.header.type == MessageType.MINUTE_UPDATE:
-                self.log.debug('handling minute update message id=%s' % message.minuteUpdateMessage.minuteId)
-                self.chat_minute_handler.update_models(message)
-
-            elif message.header.type == MessageType.MARKER_CREATE:
-                self.log.debug('handling marker create message id=%s' % message.markerCreateMessage.markerId)
-                self.chat_marker_handler.create_models(message)
-
-            elif message.header.type == MessageType.TAG_CREATE:
-                self.log.debug('handling tag create message id=%s' % message.tagCreateMessage.tagId)
-                self.chat_tag_handler.create_models(message)
-
-            elif message.header.type == MessageType.TAG_DELETE:
-                self.log.debug('handling tag delete message id=%s' % message.tagDeleteMessage.tagId)
-                self.chat_tag_handler.delete_models(message)
+            handler_method = self.message_handlers.get(message.header.type)
+            if handler_method:
+                self.log.debug('handling %s message',
+                        MessageType._VALUES_TO_NAMES.get(message.header.type))
+                handler_method(message)
 
         except TagIdDoesNotExistException as e:
             self.log.warning('Attempted to access tag that does not exist with tagID=%s', e.id)
@@ -195,7 +215,7 @@ class ChatMinuteHandler(MessageHandler):
     """
         Handler for Chat Minute messages.
 
-        This class creates/updates/deletes ChatMinute model instances.
+        This class creates/updates/deletes ChatMinuteData records.
         Each instance of this class should be used to process
         all messages from a chat.  Call finalize() after processing
         all messages to return all models to persist.
@@ -227,6 +247,11 @@ class ChatMinuteHandler(MessageHandler):
         """
     DEFAULT_MINUTE_START_TIME = 0
 
+    MESSAGE_TYPES = {
+        MessageType.MINUTE_CREATE: "create_models",
+        MessageType.MINUTE_UPDATE: "update_models"
+    }
+
     def __init__(self, chat_message_handler):
         super(ChatMinuteHandler, self).__init__(chat_message_handler)
         self.log = logging.getLogger(__name__)
@@ -243,7 +268,10 @@ class ChatMinuteHandler(MessageHandler):
         # which parent topics each leaf topic is responsible
         # for closing (setting the chat-minute's end time).
         # { leaf_topic_id : [parent1_topic_id, parent2_topic_id, ...] }
-        self.minute_end_topic_chain = self._get_chat_minute_end_topic_chain(self.topics_collection)
+        # The chain is shared by all chats using the topics collection.
+        self.minute_end_topic_chain = self.topics_collection.get_derived(
+            "minute_end_topic_chain",
+            lambda: self._get_chat_minute_end_topic_chain(self.topics_collection))
 
 
     def _get_highest_ranked_leafs(self, topics_collection):
@@ -415,7 +443,7 @@ class ChatMinuteHandler(MessageHandler):
         # As the chat messages are processed each chat minute's
         # start and end time will be modified.
         for topic in self.topics_collection.as_list_by_rank():
-            minute = ChatMinute(
+            minute = ChatMinuteData(
                 chat_session_id=self.chat_session_id,
                 topic_id=topic.id,
                 start=self.DEFAULT_MINUTE_START_TIME,
@@ -592,7 +620,7 @@ class ChatMarkerHandler(MessageHandler):
     """
         Handler for Chat Marker messages
 
-        This class creates/updates/deletes ChatSpeakingMarker model instances.
+        This class creates/updates/deletes ChatSpeakingMarkerData records.
         Each instance of this class should be used to process
         all messages from a chat.  Call finalize() after processing
         all messages to return all models to persist.
@@ -612,6 +640,10 @@ class ChatMarkerHandler(MessageHandler):
     SPEAKING_DURATION_THRESHOLD = 0 # Persist all speaking markers
     #TODO Detect if the current speaking marker gets too large
 
+    MESSAGE_TYPES = {
+        MessageType.MARKER_CREATE: "create_models"
+    }
+
 
     def __init__(self, chat_message_handler):
         super(ChatMarkerHandler, self).__init__(chat_message_handler)
@@ -722,7 +754,7 @@ class ChatMarkerHandler(MessageHandler):
                         chat_minute = self.chat_message_handler.chat_minute_handler.get_active_minute()
                         start_time = tz.timestamp_to_utc(user_speaking_data.get_start_timestamp())
                         end_time = tz.timestamp_to_utc(user_speaking_data.get_end_timestamp())
-                        created_model = ChatSpeakingMarker(
+                        created_model = ChatSpeakingMarkerData(
                             user_id=user_id,
                             chat_minute=chat_minute,
                             start=start_time,
@@ -802,7 +834,7 @@ class ChatTagHandler(MessageHandler):
     """
         Handler for Chat Tag messages
 
-        This class creates/updates/deletes ChatTag model instances.
+        This class creates/updates/deletes ChatTagData records.
         Each instance should be used to process messages from
         a chat.  Call finalize() after processing all messages
         to return all created tag models.
@@ -818,6 +850,11 @@ class ChatTagHandler(MessageHandler):
 
         """
 
+    MESSAGE_TYPES = {
+        MessageType.TAG_CREATE: "create_models",
+        MessageType.TAG_DELETE: "delete_models"
+    }
+
     def __init__(self, chat_message_handler):
         super(ChatTagHandler, self).__init__(chat_message_handler)
         self.log = logging.getLogger(__name__)
@@ -914,7 +951,7 @@ class ChatTagHandler(MessageHandler):
 
         if self._is_valid_create_tag_message(message):
             chat_minute = self.chat_message_handler.chat_minute_handler.get_active_minute()
-            created_model = ChatTag(
+            created_model = ChatTagData(
                 user_id=message.header.userId,
                 time = tz.timestamp_to_utc(message.header.timestamp),
                 chat_minute=chat_minute,
@@ -947,15 +984,6 @@ class ChatTagHandler(MessageHandler):
         tag_id = message.tagDeleteMessage.tagId
         if self._is_valid_delete_tag_message(message):
             tag_model = self.all_tags[tag_id].get_model()
-            # IMPORTANT: Set chat minute ref to None so that the Chat_Minute
-            # back-reference to ChatTag doesn't create it automagically.
-            #
-            # If the back-reference creates deleted tags for us we could potentially
-            # run into a database error if a user were to create a tag, delete it,
-            # and then create the same tag and delete it again, This tag
-            # would be created twice by SQLAlchemy which would violate the
-            # ChatTag table's unique constraint.
-            tag_model.chat_minute = None
             tag_model.deleted = True
             deleted_model = tag_model
             self._update_tags_to_persist(
@@ -1107,3 +1135,49 @@ class SpeakingData(object):
             self.end is not None):
             ret = self.end - self.start
         return ret
+
+
+class ChatMinuteData(object):
+    """
+        Chat minute record created by the ChatMinuteHandler.
+
+        Handlers create plain records, rather than ChatMinute
+        models, so that processing chat messages does not
+        pay for ORM instrumentation or require a db session.
+        Attributes match those of the ChatMinute model.
+    """
+    __slots__ = ["chat_session_id", "topic_id", "start", "end"]
+
+    def __init__(self, chat_session_id, topic_id, start, end):
+        self.chat_session_id = chat_session_id
+        self.topic_id = topic_id
+        self.start = start
+        self.end = end
+
+class ChatSpeakingMarkerData(object):
+    """
+        Speaking marker record created by the ChatMarkerHandler.
+        Attributes match those of the ChatSpeakingMarker model.
+    """
+    __slots__ = ["user_id", "chat_minute", "start", "end"]
+
+    def __init__(self, user_id, chat_minute, start, end):
+        self.user_id = user_id
+        self.chat_minute = chat_minute
+        self.start = start
+        self.end = end
+
+class ChatTagData(object):
+    """
+        Tag record created by the ChatTagHandler.
+        Attributes match those of the ChatTag model.
+    """
+    __slots__ = ["user_id", "time", "chat_minute", "tag_id", "name", "deleted"]
+
+    def __init__(self, user_id, time, chat_minute, tag_id, name, deleted):
+        self.user_id = user_id
+        self.time = time
+        self.chat_minute = chat_minute
+        self.tag_id = tag_id
+        self.name = name
+        self.deleted = deleted
@@ -1,19 +1,168 @@
 import datetime
 import logging
+import threading
 
-from sqlalchemy.sql import func
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func, or_, text
 
-from trchatsvc.gen.ttypes import Message
+from trchatsvc.gen.ttypes import Message, MessageType
 from trpycore.thrift.serialization import deserialize
 from trpycore.timezone import tz
-from trsvcscore.db.models import ChatPersistJob, ChatMessage, \
-    ChatMessageFormatType, ChatArchiveJob, ChatSession, \
-    ChatHighlightSession
-
-from message_handler import ChatMessageHandler
+from trsvcscore.db.models import Chat, ChatPersistJob, ChatMessage, \
+    ChatMessageFormatType, ChatMessageType, ChatArchiveJob, ChatSession, \
+    ChatHighlightSession, ChatUser, Topic
+
+from chat_data_writer import ChatDataWriter
+from lookup_cache import lookup_cache
+from message_handler import ChatMessageHandler, ChatMinuteData, \
+    ChatSpeakingMarkerData, ChatTagData
 from persistsvc_exceptions import DuplicatePersistJobException
-from topic_data_manager import TopicDataManager
+from topic_collection_cache import topic_collection_cache
+from topic_data_manager import TopicDataCollection
+
+
+def get_message_type_ids(db_session):
+    """Get the ids of the ChatMessageTypes consumed by the ChatMessageHandler.
+
+    Message types without a ChatMessageType row are left out,
+    since no stored chat message can be of that type.
+
+    Args:
+        db_session: sqlalchemy db session used to load the lookup cache
+
+    Returns:
+        list of ChatMessageType ids
+    """
+    names = [MessageType._VALUES_TO_NAMES[message_type]
+             for message_type in ChatMessageHandler.get_message_types()]
+    return lookup_cache.get_existing_ids(db_session, ChatMessageType, names)
+
+
+def load_job_contexts(db_session, job_ids):
+    """Load the context of ChatPersistJobs.
+
+    The job, chat session, chat, root topic, and participants
+    of all jobs are read with a single query.
+
+    Args:
+        db_session: sqlalchemy db session
+        job_ids: list of ChatPersistJob ids
+
+    Returns:
+        dict of ChatPersistJobContext by job id
+    """
+    rows = db_session.query(
+            ChatPersistJob.id,
+            ChatPersistJob.chat_session_id,
+            Chat.id,
+            Chat.topic_id,
+            Topic.title,
+            func.array_agg(ChatUser.user_id)).\
+        join(ChatSession, ChatSession.id == ChatPersistJob.chat_session_id).\
+        join(Chat, Chat.id == ChatSession.chat_id).\
+        join(Topic, Topic.id == Chat.topic_id).\
+        outerjoin(ChatUser, ChatUser.chat_session_id == ChatSession.id).\
+        filter(ChatPersistJob.id.in_(job_ids)).\
+        group_by(ChatPersistJob.id, ChatPersistJob.chat_session_id,
+                 Chat.id, Chat.topic_id, Topic.title).\
+        all()
+
+    job_contexts = {}
+    for job_id, chat_session_id, chat_id, root_topic_id, root_topic_title, user_ids in rows:
+        # The outer join yields [None] for chats without participants
+        participant_ids = sorted(set(user_id for user_id in user_ids if user_id is not None))
+        job_contexts[job_id] = ChatPersistJobContext(
+            job_id,
+            chat_session_id,
+            chat_id,
+            root_topic_id,
+            root_topic_title,
+            participant_ids)
+    return job_contexts
+
+
+def process_chat_messages(chat_session_id, topic_list_by_rank, chat_message_data):
+    """Process chat messages into rows to persist.
+
+    This is the compute stage of a persist job: decoding and
+    deserializing chat message data, and processing the messages
+    with the ChatMessageHandler. It does not require a db session,
+    and its arguments and return value are plain picklable data,
+    so it may be run in a worker process.
+
+    Messages are deserialized one at a time as they are processed,
+    so if chat_message_data is a generator, only one message is
+    held in memory at once.
+
+    Args:
+        chat_session_id: ChatSession id
+        topic_list_by_rank: list of the chat's TopicData objects
+            ordered by rank.
+        chat_message_data: iterable of serialized chat message data
+            in chronological order.
+
+    Returns:
+        dict with 'minutes', 'markers', and 'tags' keys, each a
+        list of row dicts in the order they should be persisted.
+        Markers and tags reference their chat minute by topic_id.
+    """
+    return process_chat_messages_for_collection(
+        chat_session_id,
+        TopicDataCollection(topic_list_by_rank),
+        chat_message_data)
+
+
+def process_chat_messages_for_collection(chat_session_id, topics_collection, chat_message_data):
+    """Process chat messages into rows to persist.
+
+    Same as process_chat_messages(), but takes the chat's
+    TopicDataCollection, so that a cached collection and the
+    structures derived from it are reused when processing
+    chat messages in the current process.
+
+    Args:
+        chat_session_id: ChatSession id
+        topics_collection: the chat's TopicDataCollection
+        chat_message_data: iterable of serialized chat message data
+            in chronological order.
+
+    Returns:
+        dict of rows, as returned by process_chat_messages().
+    """
+    handler = ChatMessageHandler(chat_session_id, topics_collection)
+    for data in chat_message_data:
+        message = Message()
+        deserialize(message, data)
+        handler.process(message)
+
+    rows = {
+        "minutes": [],
+        "markers": [],
+        "tags": []
+    }
+    for model in handler.finalize():
+        if isinstance(model, ChatMinuteData):
+            rows["minutes"].append({
+                "topic_id": model.topic_id,
+                "start": model.start,
+                "end": model.end
+            })
+        elif isinstance(model, ChatSpeakingMarkerData):
+            rows["markers"].append({
+                "topic_id": model.chat_minute.topic_id,
+                "user_id": model.user_id,
+                "start": model.start,
+                "end": model.end
+            })
+        elif isinstance(model, ChatTagData):
+            rows["tags"].append({
+                "topic_id": model.chat_minute.topic_id,
+                "user_id": model.user_id,
+                "time": model.time,
+                "tag_id": model.tag_id,
+                "name": model.name,
+                "deleted": model.deleted
+            })
+    return rows
 
 
 
@@ -27,13 +176,84 @@ class ChatPersister(object):
 
         Responsible for creating ChatHighlightSession from the ChatSession.
         Responsible for creating ChatArchiveJob to be processed by the archive svc.
+
+        If a multiprocessing compute_pool is provided, the CPU bound
+        processing of chat messages (see process_chat_messages) is done
+        in a worker process, and only the db reads and writes are done
+        in the calling thread.
+
+        Failed jobs are retried, with exponential backoff, by creating a
+        new ChatPersistJob for the chat session which may not be claimed
+        until its 'start' time. Once a chat session has failed more than
+        retry_attempts times in a row no further job is created, and the
+        last failed job is marked as the dead-letter record by prefixing
+        its owner with DEAD_LETTER_OWNER_PREFIX.
     """
 
-    def __init__(self, db_session_factory, job_id):
+    # Number of chat messages fetched from the db at a time
+    MESSAGE_FETCH_SIZE = 500
+
+    # Owner prefix of failed jobs which will not be retried
+    DEAD_LETTER_OWNER_PREFIX = "dead-letter:"
+
+    # Maximum length of the owners written to chat_persist_job.owner,
+    # including any prefix, which must fit the width of the column.
+    OWNER_MAX_LENGTH = 64
+
+    # Maximum number of statements issued to create the highlights
+    # of a chat, while concurrent jobs keep taking the ranks computed.
+    HIGHLIGHT_ATTEMPTS = 5
+
+    # Create a ChatHighlightSession, ranked after the user's existing
+    # highlights, for each of the given chat participants. Participants
+    # who already have a highlight for the chat session conflict on its
+    # (chat_session_id, user_id) constraint and are skipped. Concurrent
+    # jobs for the same user may compute the same rank, in which case
+    # the later insert conflicts on the (user_id, rank) constraint, once
+    # the earlier commits, and is skipped; the caller retries those
+    # participants. Rows are inserted in user id order so concurrent
+    # inserts wait on each other in a consistent order.
+    # ON CONFLICT, like the SKIP LOCKED used to claim persist jobs,
+    # requires PostgreSQL 9.5 or later.
+    CREATE_HIGHLIGHTS_SQL = text("""
+        INSERT INTO chat_highlight_session (chat_session_id, user_id, rank)
+        SELECT :chat_session_id, participant.user_id,
+            COALESCE((
+                SELECT max(highlight.rank) FROM chat_highlight_session highlight
+                WHERE highlight.user_id = participant.user_id), -1) + 1
+        FROM (
+            SELECT DISTINCT unnest(CAST(:user_ids AS integer[])) AS user_id) participant
+        ORDER BY participant.user_id
+        ON CONFLICT DO NOTHING
+        RETURNING user_id""")
+
+    def __init__(self, db_session_factory, job_id, owner, retry_attempts=3,
+            retry_seconds=60, compute_pool=None):
+        """Constructor.
+
+        Arguments:
+            db_session_factory: callable returning new sqlalchemy
+                db session.
+            job_id: id of the claimed ChatPersistJob to process
+            owner: owner of the claimed ChatPersistJob
+            retry_attempts: maximum number of times to retry
+                a failed chat session.
+            retry_seconds: number of seconds to wait before the
+                first retry. Doubled for each subsequent retry.
+            compute_pool: optional multiprocessing Pool in which
+                to process chat messages.
+        """
         self.log = logging.getLogger(__name__)
         self.db_session_factory = db_session_factory
         self.job_id = job_id
+        self.owner = owner
+        self.retry_attempts = retry_attempts
+        self.retry_seconds = retry_seconds
+        self.compute_pool = compute_pool
         self.chat_session_id = None
+        self.job_context = None
+        self.num_messages = 0
+        self.chat_data_writer = ChatDataWriter()
 
     def create_db_session(self):
         """Create  new sqlalchemy db session.
@@ -49,127 +269,188 @@ class ChatPersister(object):
 
             Only data we plan on consuming is currently
             being persisted.
+
+            The job is expected to have already been claimed
+            by the ChatPersistJobMonitor.
         """
+        db_session = None
         try:
-            # The start_job method has its own db_session
-            # since it needs to commit to the db immediately to
-            # claim the job.
-            self._start_chat_persist_job()
+            self.log.info("Starting chat persist job with job_id=%d ..." % self.job_id)
 
-            # Create a single db_session for the rest of the db changes
+            # Create a single db_session for all db changes
             # so that we can commit all of them together. This will
             # make it easy to rerun jobs that fail.
             db_session = self.create_db_session()
             self._persist_data(db_session)
             self._create_chat_archive_job(db_session)
+            self._end_chat_persist_job(db_session)
+            db_session.commit()
 
             # It's possible the user has already created a chat highlight for this chat.
-            # When this happens, calling commit() would cause the db session to rollback.
-            # To prevent losing all other session data, we create a separate db session.
-            # Note that we can't check for the existence of the chat highlight
-            # since it would be a potential race condition.
-            highlight_db_session = self.create_db_session()
-            self._create_chat_highlight(highlight_db_session)
-
-            self._end_chat_persist_job(db_session)
-            highlight_db_session.commit() # commit chat highlight session
-            db_session.commit() # commit everything else
+            # Existing highlights are skipped, so the highlights are created once the
+            # job has committed, in short transactions of their own.
+            self._create_chat_highlight(db_session)
 
         except DuplicatePersistJobException:
-            self.log.warning("Chat persist job with job_id=%d already claimed. Stopping processing." % self.job_id)
-            # This means that the PersistJob was claimed just before
-            # this thread claimed it. Stop processing the job. There's
-            # no need to abort the job since no processing of the job
-            # has occurred.
+            self.log.warning("Chat persist job with job_id=%d was reclaimed by another owner. Discarding results." % self.job_id)
+            # This means our lease on the job expired and the job was
+            # reclaimed before we could finish it. The new owner
+            # is responsible for the job, so discard our changes
+            # without aborting the job.
+            if db_session:
+                db_session.rollback()
 
         except Exception as e:
             self.log.exception(e)
             if db_session:
                 db_session.rollback()
-            if highlight_db_session:
-                highlight_db_session.rollback()
-            self._abort_chat_persist_job()
+                try:
+                    self._abort_chat_persist_job(db_session)
+                    db_session.commit()
+                except Exception as error:
+                    self.log.error(error)
+                    db_session.rollback()
 
         finally:
             if db_session:
                 db_session.close()
-            if highlight_db_session:
-                highlight_db_session.close()
 
-    def _start_chat_persist_job(self):
-        """Start processing the chat persist job.
+    def _get_worker_owner(self):
+        """Get the owner qualified with the current worker thread.
+
+        The worker owner is informational, so it is truncated to
+        leave room for DEAD_LETTER_OWNER_PREFIX within OWNER_MAX_LENGTH.
 
-        Mark the ChatPersistJob record in the db as started by
-        updating the 'owner' field and the 'start' field.
+        Returns:
+            owner string of the form <owner>/<thread name>
         """
-        self.log.info("Starting chat persist job with job_id=%d ..." % self.job_id)
+        owner = "%s/%s" % (self.owner, threading.current_thread().name)
+        return owner[:self.OWNER_MAX_LENGTH - len(self.DEAD_LETTER_OWNER_PREFIX)]
 
-        try:
-            db_session = self.create_db_session()
+    def _end_chat_persist_job(self, db_session):
+        """End processing of the ChatPersistJob.
+
+        Mark the ChatPersistJob record as finished by updating the 'end'
+        field with the current time, and qualify the 'owner' field
+        with the worker thread which processed the job.
 
-            # This query.update generates the following sql:
-            # UPDATE chat_persist_job SET owner='persistsvc' WHERE
-            # chat_persist_job.id = 1 AND chat_persist_job.owner IS NULL
+        Throws:
+            DuplicatePersistJobException if the job is no
+            longer owned by this persister.
+        """
+        try:
             num_rows_updated = db_session.query(ChatPersistJob).\
                 filter(ChatPersistJob.id==self.job_id).\
-                filter(ChatPersistJob.owner==None).\
+                filter(ChatPersistJob.owner==self.owner).\
+                filter(ChatPersistJob.end==None).\
                 update({
-                    ChatPersistJob.owner: 'persistsvc',
-                    ChatPersistJob.start: tz.utcnow()
-                })
+                    ChatPersistJob.owner: self._get_worker_owner(),
+                    ChatPersistJob.end: func.current_timestamp(),
+                    ChatPersistJob.successful: True
+                }, synchronize_session=False)
 
             if not num_rows_updated:
                 raise DuplicatePersistJobException()
 
-            db_session.commit()
-
-        except DuplicatePersistJobException as e:
-            # No data was modified in the db so no need to rollback.
-            raise e
-        except Exception as e:
-            self.log.exception(e)
-            db_session.rollback()
-            raise e
-        finally:
-            if db_session:
-                db_session.close()
-
-    def _end_chat_persist_job(self, db_session):
-        """End processing of the ChatPersistJob.
-
-        Mark the ChatPersistJob record as finished by updating the 'end'
-        field with the current time.
-        """
-        try:
-            job = db_session.query(ChatPersistJob).filter(ChatPersistJob.id==self.job_id).one()
-            job.end = func.current_timestamp()
-            job.successful = True
-            db_session.flush()
             self.log.info("Finishing chat persist job with job_id=%d ..." % self.job_id)
         except Exception as e:
             raise e
 
-    def _abort_chat_persist_job(self):
+    def _abort_chat_persist_job(self, db_session):
         """Abort the ChatPersistJob.
 
         Abort the current persist job. Mark the
-        job's status as a failure.
+        job's status as a failure, and schedule a retry,
+        if the job is still owned by this persister.
+        The caller is responsible for committing db_session.
         """
 
         self.log.error("Aborting chat persist job with job_id=%d ..." % self.job_id)
 
-        try:
-            db_session = self.create_db_session()
-            job = db_session.query(ChatPersistJob).filter(ChatPersistJob.id==self.job_id).one()
-            job.successful = False
-            db_session.commit()
-        except Exception as e:
-            self.log.error(e)
-            if db_session:
-                db_session.rollback()
-        finally:
-            if db_session:
-                db_session.close()
+        num_rows_updated = db_session.query(ChatPersistJob).\
+            filter(ChatPersistJob.id==self.job_id).\
+            filter(ChatPersistJob.owner==self.owner).\
+            update({
+                ChatPersistJob.owner: self._get_worker_owner(),
+                ChatPersistJob.successful: False
+            }, synchronize_session=False)
+        if num_rows_updated:
+            self._retry_chat_persist_job(db_session)
+
+    def _retry_chat_persist_job(self, db_session):
+        """Schedule a retry of the failed ChatPersistJob.
+
+        Creates a new ChatPersistJob for the chat session, with
+        a 'start' time, and no owner, indicating the time after
+        which the job may be claimed. The delay doubles with each
+        failed job in the chat session's current retry chain, which
+        starts after its last successful or dead-lettered job. Once
+        the retries are exhausted the job is marked dead-lettered.
+        """
+        chat_session_id = db_session.query(ChatPersistJob.chat_session_id).\
+            filter(ChatPersistJob.id==self.job_id).\
+            scalar()
+
+        chain_start_id = db_session.query(func.max(ChatPersistJob.id)).\
+            filter(ChatPersistJob.chat_session_id==chat_session_id).\
+            filter(or_(
+                ChatPersistJob.successful==True,
+                ChatPersistJob.owner.startswith(self.DEAD_LETTER_OWNER_PREFIX))).\
+            scalar()
+
+        num_failures = db_session.query(ChatPersistJob).\
+            filter(ChatPersistJob.chat_session_id==chat_session_id).\
+            filter(ChatPersistJob.id > (chain_start_id or 0)).\
+            filter(ChatPersistJob.successful==False).\
+            count()
+
+        retry_seconds = self._get_retry_seconds(num_failures)
+        if retry_seconds is None:
+            db_session.query(ChatPersistJob).\
+                filter(ChatPersistJob.id==self.job_id).\
+                update({
+                    ChatPersistJob.owner: self.DEAD_LETTER_OWNER_PREFIX + self._get_worker_owner()
+                }, synchronize_session=False)
+            self.log.error("Chat persist job with job_id=%d failed %d times for chat_session_id=%d. Giving up." \
+                    % (self.job_id, num_failures, chat_session_id))
+            return
+
+        now = tz.utcnow()
+        job = ChatPersistJob(
+                chat_session_id=chat_session_id,
+                created=now,
+                start=now + datetime.timedelta(seconds=retry_seconds))
+        db_session.add(job)
+        db_session.flush()
+
+        self.log.info("Retrying chat persist job with job_id=%d as job_id=%d in %d seconds." \
+                % (self.job_id, job.id, retry_seconds))
+
+    def _get_retry_seconds(self, num_failures):
+        """Get the delay before retrying a failed chat session.
+
+        Args:
+            num_failures: number of failed jobs in the chat
+                session's current retry chain.
+        Returns:
+            number of seconds to wait before the retry, or None
+            if the chat session has exhausted its retries.
+        """
+        if num_failures > self.retry_attempts:
+            return None
+        return self.retry_seconds * 2 ** (num_failures - 1)
+
+    def _load_job_context(self, db_session):
+        """Load the job's ChatPersistJobContext.
+
+        The context is reused by each later stage of the job.
+        """
+        self._set_job_context(load_job_contexts(db_session, [self.job_id])[self.job_id])
+
+    def _set_job_context(self, job_context):
+        """Set the job's ChatPersistJobContext."""
+        self.job_context = job_context
+        self.chat_session_id = job_context.chat_session_id
 
     def _persist_data(self, db_session):
         """Persist chat data to the db
@@ -179,56 +460,97 @@ class ChatPersister(object):
         that were created by the chat service.
         """
         try:
-            # Retrieve the chat session id
-            job = db_session.query(ChatPersistJob).filter(ChatPersistJob.id==self.job_id).one()
-            self.chat_session_id = job.chat_session.id
+            # Retrieve the chat session and root topic
+            self._load_job_context(db_session)
 
             # Specify the format of the msg data
-            thrift_b64_format_id = db_session.query(ChatMessageFormatType).\
-                filter(ChatMessageFormatType.name=='THRIFT_BINARY_B64').\
-                one().\
-                id
+            thrift_b64_format_id = lookup_cache.get_id(
+                db_session, ChatMessageFormatType, 'THRIFT_BINARY_B64')
+
+            # Only read the types of message the handlers consume
+            message_type_ids = get_message_type_ids(db_session)
 
             # Read all chat messages that were stored by the chat svc.
             # It's important that the messages be consumed in chronological
             # order so that ordering dependencies between messages can be
             # properly handled.
             # (e.g. ChatTags needing a reference to a ChatMinute)
-            chat_messages = db_session.query(ChatMessage).\
+            # Messages are streamed from a server-side cursor as they
+            # are processed, so long chats are not read into memory
+            # at once. The query is not executed until iterated.
+            # Only the needed columns are selected, so no ChatMessage
+            # entities are built or added to the session's identity map.
+            # Messages with equal timestamps are ordered by id, the
+            # order in which they were stored.
+            chat_messages = db_session.query(ChatMessage.timestamp, ChatMessage.data).\
                 filter(ChatMessage.chat_session_id == self.chat_session_id).\
                 filter(ChatMessage.format_type_id == thrift_b64_format_id).\
-                order_by(ChatMessage.timestamp).\
-                all()
+                filter(ChatMessage.type_id.in_(message_type_ids)).\
+                order_by(ChatMessage.timestamp, ChatMessage.id).\
+                execution_options(stream_results=True).\
+                yield_per(self.MESSAGE_FETCH_SIZE)
 
-            self.log.info("Persist job_id=%d found %d messages to process for chat_session_id=%d" %
-                          (self.job_id, len(chat_messages), self.chat_session_id))
+            # Generate topics collection for this chat
+            topics_collection = topic_collection_cache.get_collection(
+                db_session, self.job_context.root_topic_id)
 
-            # Deserialize all chat message data
-            deserialized_chat_msgs = []
-            for chat_message in chat_messages:
-                deserialized_msg = Message()
-                deserialize(deserialized_msg, chat_message.data)
-                deserialized_chat_msgs.append(deserialized_msg)
+            self._persist_messages(
+                db_session,
+                topics_collection,
+                (data for timestamp, data in chat_messages))
 
-            # Generate topics collection for this chat
-            topics_manager = TopicDataManager()
-            topic_id = topics_manager.get_root_topic_id(db_session, self.chat_session_id)
-            topics_collection = topics_manager.get_collection(db_session, topic_id)
+        except Exception as e:
+            raise e
 
-            # Process the deserialized chat messages
-            handler = ChatMessageHandler(self.chat_session_id, topics_collection)
-            for message in deserialized_chat_msgs:
-                handler.process(message)
+    def _persist_messages(self, db_session, topics_collection, chat_message_data):
+        """Persist chat data for the given chat messages to the db
 
-            # Persist the generated models
-            models_to_persist = handler.finalize()
-            for model in models_to_persist:
-                db_session.add(model)
+        Args:
+            db_session: sqlalchemy db session
+            topics_collection: the chat's TopicDataCollection
+            chat_message_data: iterable of serialized chat message
+                data in chronological order.
+        """
+        self.num_messages = 0
+        chat_message_data = self._count_messages(chat_message_data)
+
+        # Process the chat messages into rows to persist
+        if self.compute_pool is not None:
+            # Messages must be read in full to be sent to the worker process
+            rows = self.compute_pool.apply(process_chat_messages, (
+                self.chat_session_id,
+                topics_collection.as_list_by_rank(),
+                list(chat_message_data)))
+        else:
+            rows = process_chat_messages_for_collection(
+                self.chat_session_id,
+                topics_collection,
+                chat_message_data)
+
+        self.log.info("Persist job_id=%d processed %d messages for chat_session_id=%d" %
+                      (self.job_id, self.num_messages, self.chat_session_id))
+
+        # Persist the generated rows
+        self._write_rows(db_session, rows)
+
+    def _count_messages(self, chat_message_data):
+        """Generator counting chat messages as they are consumed.
+
+        Args:
+            chat_message_data: iterable of serialized chat message data
+        """
+        for data in chat_message_data:
+            self.num_messages += 1
+            yield data
 
-            db_session.flush()
+    def _write_rows(self, db_session, rows):
+        """Write the rows returned by process_chat_messages to the db.
 
-        except Exception as e:
-            raise e
+        Args:
+            db_session: sqlalchemy db session
+            rows: dict of rows returned by process_chat_messages
+        """
+        self.chat_data_writer.write(db_session, self.chat_session_id, rows)
 
     def _create_chat_archive_job(self, db_session):
         try:
@@ -253,58 +575,72 @@ class ChatPersister(object):
         By default, the chat being processed by this service will
         be added to each participant's 'highlight reel' by creating
         an associated ChatHighlightSession object.
-        Each ChatHighlightSession is assigned the lowest possible rank.
+        Each ChatHighlightSession is ranked after the participant's
+        existing highlights, and participants who already have a
+        highlight for the chat are skipped.
+
+        Called with the job's db session once the job, or its whole
+        batch, has committed. Each statement is committed on its own,
+        so rows which concurrent jobs for the same users must wait on
+        are only held for the duration of the statement. Since the
+        job has already committed, a failure is logged rather than
+        aborting the job.
 
         Special cases:
             The Tutorial chat will not be added to a user's highlight
             reel.
         """
+        # Special case: Tutorial chat
+        # Don't create a highlight for Tutorial chats
+        if self._is_tutorial():
+            self.log.info("Skipping creation of ChatHighlight since this is a Tutorial chat.")
+            return
+
+        user_ids = set(self.job_context.participant_ids)
+        if not user_ids:
+            return
+
+        # Create ChatHighlightSession for each participant with a
+        # single statement. A participant is skipped either because
+        # they already have a highlight for the chat, or because a
+        # concurrent job took the rank computed for them. The latter
+        # are found by checking which skipped participants still have
+        # no highlight for the chat, and are retried with a new rank.
+        self.log.info("Creating ChatHighlightSession for each chat participant...")
         try:
-            # Retrieve the ChatSession
-            chat_session = db_session.query(ChatSession).\
-                filter(ChatSession.id==self.chat_session_id).\
-                one()
-
-            # Special case: Tutorial chat
-            # Don't create a highlight for Tutorial chats
-            if self._is_tutorial(chat_session):
-                self.log.info("Skipping creation of ChatHighlight since this is a Tutorial chat.")
-                return
-
-            # Create ChatHighlightSession for each participant
-            # chat_sesssion.users returns django_models.User objects.
-            self.log.info("Creating ChatHighlightSession for each chat participant...")
-            for user in chat_session.users:
-                # Determine how many highlight chats user has so that
-                # we can set the rank of the new highlight.  Highlight
-                # ranks start at 0, so setting the rank of the new
-                # highlight to the previous length will work.
-                highlight_count = db_session.query(ChatHighlightSession).\
-                    filter(ChatHighlightSession.user_id==user.id).\
-                    count()
-                highlight = ChatHighlightSession(
-                    chat_session_id=self.chat_session_id,
-                    user_id=user.id,
-                    rank=highlight_count)
-                db_session.add(highlight)
-
-            db_session.flush()
-
-        except IntegrityError as e:
-            reason = e.message
-            if "key value violates unique constraint" in reason:
-                # This occurs if the user has already manually
-                # added this chat to their highlight reel.
-                # No need to re-raise.
-                if db_session:
-                    db_session.rollback()
-            else:
-                raise e # Not the expected exception
+            num_created = 0
+            for attempt in range(self.HIGHLIGHT_ATTEMPTS):
+                result = db_session.execute(self.CREATE_HIGHLIGHTS_SQL, {
+                    "chat_session_id": self.chat_session_id,
+                    "user_ids": sorted(user_ids)
+                })
+                created_user_ids = set(row.user_id for row in result)
+                db_session.commit()
+                num_created += len(created_user_ids)
+                user_ids -= created_user_ids
+                if not user_ids:
+                    break
+
+                existing_highlights = db_session.query(ChatHighlightSession.user_id).\
+                    filter(ChatHighlightSession.chat_session_id==self.chat_session_id).\
+                    filter(ChatHighlightSession.user_id.in_(user_ids))
+                user_ids -= set(user_id for (user_id,) in existing_highlights)
+                db_session.commit()
+                if not user_ids:
+                    break
+
+            if user_ids:
+                self.log.error("Unable to create ChatHighlightSession for user_ids=%s of chat_session_id=%d." %
+                        (sorted(user_ids), self.chat_session_id))
+
+            self.log.info("Created %d ChatHighlightSessions for chat_session_id=%d" %
+                    (num_created, self.chat_session_id))
 
         except Exception as e:
-            raise e
+            self.log.exception(e)
+            db_session.rollback()
 
-    def _is_tutorial(self, chat_session):
+    def _is_tutorial(self):
         """Check if ChatSession was for a Tutorial chat.
 
         Returns:
@@ -313,6 +649,231 @@ class ChatPersister(object):
         """
         ret = False
         tutorial_chat_title = 'Tutorial'
-        if chat_session.chat.topic.title == tutorial_chat_title:
+        if self.job_context.root_topic_title == tutorial_chat_title:
             ret = True
         return ret
+
+
+class ChatBatchPersister(object):
+    """
+        Responsible for persisting the chat messages of a batch of
+        ChatPersistJobs in a single db transaction.
+
+        The chat messages of all jobs in the batch are read with a
+        single query, and topic collections are read once per root
+        topic and shared by the jobs which need them. Each job is
+        persisted within its own SAVEPOINT, so a failed job is rolled
+        back without affecting the rest of the batch, and failed jobs
+        are aborted within the same transaction.
+    """
+
+    def __init__(self, db_session_factory, job_ids, owner, retry_attempts=3,
+            retry_seconds=60, compute_pool=None):
+        """Constructor.
+
+        Arguments:
+            db_session_factory: callable returning new sqlalchemy
+                db session.
+            job_ids: ids of the claimed ChatPersistJobs to process
+            owner: owner of the claimed ChatPersistJobs
+            retry_attempts: maximum number of times to retry
+                a failed chat session.
+            retry_seconds: number of seconds to wait before the
+                first retry. Doubled for each subsequent retry.
+            compute_pool: optional multiprocessing Pool in which
+                to process chat messages.
+        """
+        self.log = logging.getLogger(__name__)
+        self.db_session_factory = db_session_factory
+        self.persisters = []
+        for job_id in job_ids:
+            self.persisters.append(ChatPersister(
+                db_session_factory,
+                job_id,
+                owner,
+                retry_attempts,
+                retry_seconds,
+                compute_pool))
+
+    def create_db_session(self):
+        """Create  new sqlalchemy db session.
+
+        Returns:
+            sqlalchemy db session
+        """
+        return self.db_session_factory()
+
+    def persist(self):
+        """Persist the chat message data of all jobs in the batch.
+
+            The jobs are expected to have already been claimed
+            by the ChatPersistJobMonitor.
+        """
+        db_session = None
+        failed_persisters = []
+        ended_persisters = []
+        try:
+            self.log.info("Starting batch of %d chat persist jobs ..." % len(self.persisters))
+
+            db_session = self.create_db_session()
+            persisters = self._load_job_contexts(db_session)
+            for persister in self.persisters:
+                if persister not in persisters:
+                    failed_persisters.append(persister)
+
+            chat_message_data, topic_collections = self._read_data(db_session, persisters)
+
+            for persister in persisters:
+                db_session.begin_nested()
+                try:
+                    persister._persist_messages(
+                        db_session,
+                        topic_collections[persister.chat_session_id],
+                        chat_message_data.get(persister.chat_session_id, []))
+                    persister._create_chat_archive_job(db_session)
+                    persister._end_chat_persist_job(db_session)
+                    db_session.commit() # release SAVEPOINT
+                    ended_persisters.append(persister)
+
+                except DuplicatePersistJobException:
+                    self.log.warning("Chat persist job with job_id=%d was reclaimed by another owner. Discarding results." % persister.job_id)
+                    db_session.rollback() # roll back to SAVEPOINT
+
+                except Exception as e:
+                    self.log.exception(e)
+                    db_session.rollback() # roll back to SAVEPOINT
+                    failed_persisters.append(persister)
+
+            self._abort_chat_persist_jobs(db_session, failed_persisters)
+            db_session.commit()
+
+            # Highlights are created once the batch has committed
+            # (see ChatPersister._create_chat_highlight).
+            for persister in ended_persisters:
+                persister._create_chat_highlight(db_session)
+
+        except Exception as e:
+            self.log.exception(e)
+            if db_session:
+                db_session.rollback()
+                try:
+                    self._abort_chat_persist_jobs(db_session, self.persisters)
+                    db_session.commit()
+                except Exception as error:
+                    self.log.error(error)
+                    db_session.rollback()
+
+        finally:
+            if db_session:
+                db_session.close()
+
+    def _abort_chat_persist_jobs(self, db_session, persisters):
+        """Abort failed ChatPersistJobs.
+
+        Each job is aborted within its own SAVEPOINT, so a
+        failure to abort one job does not affect the others.
+        The caller is responsible for committing db_session.
+
+        Arguments:
+            db_session: sqlalchemy db session
+            persisters: ChatPersisters of the failed jobs
+        """
+        for persister in persisters:
+            db_session.begin_nested()
+            try:
+                persister._abort_chat_persist_job(db_session)
+                db_session.commit() # release SAVEPOINT
+            except Exception as e:
+                self.log.error(e)
+                db_session.rollback() # roll back to SAVEPOINT
+
+    def _load_job_contexts(self, db_session):
+        """Load the job context of each persister in the batch.
+
+        Jobs whose context can not be loaded are left out,
+        so they can be aborted without failing the batch.
+
+        Returns:
+            list of the ChatPersisters whose job context was set.
+        """
+        job_ids = [persister.job_id for persister in self.persisters]
+        job_contexts = load_job_contexts(db_session, job_ids)
+
+        persisters = []
+        for persister in self.persisters:
+            job_context = job_contexts.get(persister.job_id)
+            if job_context is None:
+                self.log.error("Unable to load context of chat persist job with job_id=%d." % persister.job_id)
+            else:
+                persister._set_job_context(job_context)
+                persisters.append(persister)
+        return persisters
+
+    def _read_data(self, db_session, persisters):
+        """Read the data required to persist jobs in the batch.
+
+        Arguments:
+            db_session: sqlalchemy db session
+            persisters: ChatPersisters whose job context is set
+        Returns:
+            (chat_message_data, topic_collections) tuple, where
+            chat_message_data is a dict of chat_session_id to list
+            of serialized chat message data in chronological order,
+            and topic_collections is a dict of chat_session_id to
+            the chat's TopicDataCollection.
+        """
+        if not persisters:
+            return {}, {}
+
+        job_contexts = [persister.job_context for persister in persisters]
+        chat_session_ids = [job_context.chat_session_id for job_context in job_contexts]
+
+        # Specify the format of the msg data
+        thrift_b64_format_id = lookup_cache.get_id(
+            db_session, ChatMessageFormatType, 'THRIFT_BINARY_B64')
+
+        # Only read the types of message the handlers consume
+        message_type_ids = get_message_type_ids(db_session)
+
+        # Read the chat messages of all chat sessions in chronological
+        # order, grouped by chat session.
+        chat_message_data = {}
+        chat_messages = db_session.query(ChatMessage.chat_session_id, ChatMessage.data).\
+            filter(ChatMessage.chat_session_id.in_(chat_session_ids)).\
+            filter(ChatMessage.format_type_id == thrift_b64_format_id).\
+            filter(ChatMessage.type_id.in_(message_type_ids)).\
+            order_by(ChatMessage.chat_session_id, ChatMessage.timestamp, ChatMessage.id)
+        for chat_session_id, data in chat_messages:
+            chat_message_data.setdefault(chat_session_id, []).append(data)
+
+        # Read the topic collection of each distinct root topic
+        root_topic_collections = {}
+        for job_context in job_contexts:
+            root_topic_id = job_context.root_topic_id
+            if root_topic_id not in root_topic_collections:
+                root_topic_collections[root_topic_id] = \
+                    topic_collection_cache.get_collection(db_session, root_topic_id)
+
+        topic_collections = {}
+        for job_context in job_contexts:
+            topic_collections[job_context.chat_session_id] = \
+                root_topic_collections[job_context.root_topic_id]
+
+        return chat_message_data, topic_collections
+
+
+class ChatPersistJobContext(object):
+    """
+        Data structure to keep the context of a ChatPersistJob,
+        which is loaded once by load_job_contexts() and reused
+        by each stage of the job.
+    """
+
+    def __init__(self, job_id, chat_session_id, chat_id, root_topic_id,
+            root_topic_title, participant_ids):
+        self.job_id = job_id
+        self.chat_session_id = chat_session_id
+        self.chat_id = chat_id
+        self.root_topic_id = root_topic_id
+        self.root_topic_title = root_topic_title
+        self.participant_ids = participant_ids
@@ -1,4 +1,5 @@
 import logging
+import multiprocessing
 
 from trpycore.thread.util import join
 from trsvcscore.service.handler.service import ServiceHandler
@@ -6,6 +7,8 @@ from trpersistsvc.gen import TPersistService
 
 import settings
 from chat_persist_job_monitor import ChatPersistJobMonitor
+from lookup_cache import lookup_cache
+from topic_collection_cache import topic_collection_cache
 
 
 
@@ -18,6 +21,15 @@ class PersistServiceHandler(TPersistService.Iface, ServiceHandler):
         stop, join, and reinitialize.
     """
     def __init__(self, service):
+        # Worker processes in which chat messages are processed.
+        # The processes are forked here, before the service starts
+        # any threads, since a lock held by another thread at fork
+        # time (e.g. a logging lock) would never be released in the
+        # child. The pool is handed to the persist job monitor.
+        self.compute_pool = None
+        if settings.PERSISTER_PROCESSES:
+            self.compute_pool = multiprocessing.Pool(settings.PERSISTER_PROCESSES)
+
         super(PersistServiceHandler, self).__init__(
 		    service,
             zookeeper_hosts=settings.ZOOKEEPER_HOSTS,
@@ -25,25 +37,101 @@ class PersistServiceHandler(TPersistService.Iface, ServiceHandler):
 
         self.log = logging.getLogger("%s.%s" % (__name__, PersistServiceHandler.__name__))
 
-        # Create chat persist monitor which scans for new jobs
-        # to process and delegates the real work to persist data.
-        self.persist_job_monitor = ChatPersistJobMonitor(
-                settings.PERSISTER_THREADS,
-                self.get_database_session,
-                settings.PERSISTER_POLL_SECONDS)
+        # Chat persist monitor which scans for new jobs to process
+        # and delegates the real work to persist data. Created on
+        # start, once the service's hostname is available.
+        self.persist_job_monitor = None
     
+    def _load_lookup_cache(self):
+        """Load, or reload, the lookup cache.
+
+        Failure is not fatal since the cache is
+        loaded on first use if not already loaded.
+        """
+        db_session = None
+        try:
+            db_session = self.get_database_session()
+            lookup_cache.load(db_session)
+            db_session.commit()
+        except Exception as error:
+            self.log.exception(error)
+            if db_session:
+                db_session.rollback()
+        finally:
+            if db_session:
+                db_session.close()
+
     def start(self):
         """Start handler."""
         super(PersistServiceHandler, self).start()
+        self._load_lookup_cache()
+        self.persist_job_monitor = ChatPersistJobMonitor(
+                num_threads=settings.PERSISTER_THREADS,
+                db_session_factory=self.get_database_session,
+                hostname=self.service.hostname(),
+                poll_seconds=settings.PERSISTER_POLL_SECONDS,
+                notify_channel=settings.PERSISTER_NOTIFY_CHANNEL,
+                notify_poll_seconds=settings.PERSISTER_NOTIFY_POLL_SECONDS,
+                prefetch=settings.PERSISTER_PREFETCH,
+                min_poll_seconds=settings.PERSISTER_MIN_POLL_SECONDS,
+                lease_seconds=settings.PERSISTER_LEASE_SECONDS,
+                zookeeper_client=self.zookeeper_client,
+                partition_path=settings.PERSISTER_PARTITION_PATH,
+                partition_buckets=settings.PERSISTER_PARTITION_BUCKETS,
+                dispatch_path=settings.PERSISTER_DISPATCH_PATH,
+                dispatch_queue_size=settings.PERSISTER_DISPATCH_QUEUE_SIZE,
+                retry_attempts=settings.PERSISTER_RETRY_ATTEMPTS,
+                retry_seconds=settings.PERSISTER_RETRY_SECONDS,
+                max_threads=settings.PERSISTER_MAX_THREADS,
+                compute_pool=self.compute_pool,
+                batch_size=settings.PERSISTER_BATCH_SIZE)
         self.persist_job_monitor.start()
 
     
     def stop(self):
         """Stop handler."""
-        self.persist_job_monitor.stop()
+        if self.persist_job_monitor:
+            self.persist_job_monitor.stop()
         super(PersistServiceHandler, self).stop()
 
+    def reinitialize(self, requestContext):
+        """Reinitialize handler.
+
+        Reloads the lookup cache, and clears the topic
+        collection cache, in addition to the standard
+        reinitialization.
+        """
+        self._load_lookup_cache()
+        topic_collection_cache.clear()
+        return super(PersistServiceHandler, self).reinitialize(requestContext)
+
+    def getCounter(self, requestContext, key):
+        """Get service counter.
+
+        Includes the persist job monitor counters in
+        addition to the standard service counters.
+        """
+        if self.persist_job_monitor:
+            counters = self.persist_job_monitor.get_counters()
+            if key in counters:
+                return counters[key]
+        return super(PersistServiceHandler, self).getCounter(requestContext, key)
+
+    def getCounters(self, requestContext):
+        """Get service counters.
+
+        Includes the persist job monitor counters in
+        addition to the standard service counters.
+        """
+        counters = super(PersistServiceHandler, self).getCounters(requestContext)
+        if self.persist_job_monitor:
+            counters.update(self.persist_job_monitor.get_counters())
+        return counters
+
     def join(self, timeout=None):
         """Join handler."""
-        join([self.persist_job_monitor, super(PersistServiceHandler, self)], timeout)
+        threads = [super(PersistServiceHandler, self)]
+        if self.persist_job_monitor:
+            threads.insert(0, self.persist_job_monitor)
+        join(threads, timeout)
 
@@ -25,7 +25,23 @@ ZOOKEEPER_HOSTS = ["localdev:2181"]
 
 #Persister settings
 PERSISTER_THREADS = 1
+PERSISTER_MAX_THREADS = 4
+PERSISTER_PROCESSES = 0
+PERSISTER_BATCH_SIZE = 1
+PERSISTER_MIN_POLL_SECONDS = 1
 PERSISTER_POLL_SECONDS = 60
+#Channel to LISTEN on for new jobs, e.g. "chat_persist_job". Requires
+#the NOTIFY trigger documented on ChatPersistJobListener.
+PERSISTER_NOTIFY_CHANNEL = None
+PERSISTER_NOTIFY_POLL_SECONDS = 600
+PERSISTER_PREFETCH = 2
+PERSISTER_LEASE_SECONDS = 300
+PERSISTER_PARTITION_PATH = "/persistsvc/partition"
+PERSISTER_PARTITION_BUCKETS = 64
+PERSISTER_DISPATCH_PATH = None
+PERSISTER_DISPATCH_QUEUE_SIZE = 100
+PERSISTER_RETRY_ATTEMPTS = 3
+PERSISTER_RETRY_SECONDS = 60
 
 #Logging settings
 LOGGING = {
@@ -0,0 +1,99 @@
+import collections
+import logging
+import threading
+import time
+
+from topic_data_manager import TopicDataManager
+
+
+class TopicCollectionCache(object):
+    """
+    TopicCollectionCache caches TopicDataCollections by root topic id.
+
+    Many chats share the same topic tree, so rather than reading
+    the tree for every job, collections are cached, along with the
+    structures derived from them (see TopicDataCollection.get_derived()),
+    and shared by all jobs in the process. Cached collections must
+    not be modified.
+
+    The cache holds at most max_size collections, evicting the
+    least recently used, and collections expire ttl_seconds
+    after being read so that changes to topics are picked up.
+    The cache is thread-safe.
+    """
+
+    # Maximum number of cached collections
+    MAX_SIZE = 100
+
+    # Seconds after which a cached collection is re-read
+    TTL_SECONDS = 300
+
+    def __init__(self, max_size=None, ttl_seconds=None):
+        """Constructor.
+
+        Arguments:
+            max_size: optional maximum number of cached collections.
+                Defaults to MAX_SIZE.
+            ttl_seconds: optional number of seconds after which
+                a cached collection is re-read. Defaults to TTL_SECONDS.
+        """
+        self.log = logging.getLogger(__name__)
+        self.max_size = max_size or self.MAX_SIZE
+        self.ttl_seconds = ttl_seconds or self.TTL_SECONDS
+        self.topics_manager = TopicDataManager()
+        self.lock = threading.Lock()
+        self.collections = collections.OrderedDict() # {root_topic_id: (expires, collection)}
+        self.hits = 0
+        self.misses = 0
+
+    def get_collection(self, db_session, root_topic_id):
+        """Get the TopicDataCollection of a root topic.
+
+        Arguments:
+            db_session: sqlalchemy db session used to read
+                the collection if it is not cached.
+            root_topic_id: the chat's root topic id
+        Returns:
+            TopicDataCollection, which must not be modified.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.collections.pop(root_topic_id, None)
+            if entry is not None and entry[0] > now:
+                # Re-insert to mark as most recently used
+                self.collections[root_topic_id] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Read outside of the lock, so other topics are not blocked
+        collection = self.topics_manager.get_collection(db_session, root_topic_id)
+
+        with self.lock:
+            self.collections.pop(root_topic_id, None)
+            self.collections[root_topic_id] = (now + self.ttl_seconds, collection)
+            while len(self.collections) > self.max_size:
+                self.collections.popitem(last=False)
+        return collection
+
+    def clear(self):
+        """Remove all cached collections."""
+        with self.lock:
+            self.collections.clear()
+
+    def get_counters(self):
+        """Get cache counters.
+
+        Returns:
+            dict of counter name to integer value.
+        """
+        with self.lock:
+            return {
+                "topic_cache_hits": self.hits,
+                "topic_cache_misses": self.misses,
+                "topic_cache_size": len(self.collections)
+            }
+
+
+# Process-wide cache of the topic collections used by the persister
+topic_collection_cache = TopicCollectionCache()
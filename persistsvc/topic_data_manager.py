@@ -88,6 +88,7 @@ class TopicDataCollection(object):
         self.topic_dict = {}
         self.leaf_topic_list_by_rank = []
         self.parent_topic_ids = []
+        self.derived = {}
 
         for topic in topic_list_by_rank:
             # Create dict of topics
@@ -101,6 +102,27 @@ class TopicDataCollection(object):
                 self.leaf_topic_list_by_rank.append(topic)
 
 
+    def get_derived(self, key, create):
+        """
+            Return a structure derived from the topic data,
+            creating it on first use.
+
+            Derived structures are kept with the collection so
+            that they are shared when the collection is cached.
+            They must not be modified.
+
+            Args:
+                key: name of the derived structure
+                create: callable returning the derived structure
+
+            Returns:
+                The derived structure.
+        """
+        if key not in self.derived:
+            # Concurrent creation is harmless; the first one wins
+            self.derived.setdefault(key, create())
+        return self.derived[key]
+
     def as_list_by_rank(self):
         """
             Return a list of TopicData objects
@@ -0,0 +1,163 @@
+import os
+import sys
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+import persister
+from persister import ChatBatchPersister, ChatPersistJobContext
+from persistsvc_exceptions import DuplicatePersistJobException
+
+
+class BatchTestSession(object):
+    """
+        Stand-in for a db session which records
+        the transaction events.
+    """
+    def __init__(self):
+        self.events = []
+
+    def begin_nested(self):
+        self.events.append("savepoint")
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+    def close(self):
+        self.events.append("close")
+
+
+class BatchTestPersister(object):
+    """
+        Stand-in for a ChatPersister which records the stages
+        of the job run, and fails persisting messages with
+        the given error.
+    """
+    def __init__(self, job_id, error=None):
+        self.job_id = job_id
+        self.error = error
+        self.chat_session_id = None
+        self.job_context = None
+        self.calls = []
+
+    def _set_job_context(self, job_context):
+        self.job_context = job_context
+        self.chat_session_id = job_context.chat_session_id
+
+    def _persist_messages(self, db_session, topics_collection, chat_message_data):
+        self.calls.append("persist")
+        if self.error:
+            raise self.error
+
+    def _create_chat_archive_job(self, db_session):
+        self.calls.append("archive")
+
+    def _create_chat_highlight(self, db_session):
+        self.calls.append("highlight")
+        db_session.events.append("highlight")
+
+    def _end_chat_persist_job(self, db_session):
+        self.calls.append("end")
+
+    def _abort_chat_persist_job(self, db_session):
+        self.calls.append("abort")
+
+
+class BatchTestChatBatchPersister(ChatBatchPersister):
+    """
+        ChatBatchPersister of BatchTestPersisters,
+        which reads no chat messages.
+    """
+    def __init__(self, db_session, persisters):
+        super(BatchTestChatBatchPersister, self).__init__(lambda: db_session, [], "owner")
+        self.persisters = persisters
+
+    def _read_data(self, db_session, persisters):
+        topic_collections = dict((persister.chat_session_id, None) for persister in persisters)
+        return {}, topic_collections
+
+
+class ChatBatchPersisterTest(unittest.TestCase):
+    """
+        Test the ChatBatchPersister class
+    """
+
+    PERSISTED = ["persist", "archive", "end", "highlight"]
+
+    def setUp(self):
+        self.job_contexts = {}
+        self.load_job_contexts = persister.load_job_contexts
+        persister.load_job_contexts = \
+            lambda db_session, job_ids: dict(
+                (job_id, self.job_contexts[job_id])
+                for job_id in job_ids if job_id in self.job_contexts)
+        self.db_session = BatchTestSession()
+
+    def tearDown(self):
+        persister.load_job_contexts = self.load_job_contexts
+
+    def create_persister(self, job_id, error=None, context=True):
+        if context:
+            self.job_contexts[job_id] = ChatPersistJobContext(
+                job_id, job_id * 10, job_id * 100, 1, "Root", [1])
+        return BatchTestPersister(job_id, error)
+
+    def test_persist(self):
+        persisters = [self.create_persister(1), self.create_persister(2)]
+        BatchTestChatBatchPersister(self.db_session, persisters).persist()
+
+        for job_persister in persisters:
+            self.assertEqual(self.PERSISTED, job_persister.calls)
+        self.assertEqual(10, persisters[0].chat_session_id)
+
+        # Each job is persisted within a SAVEPOINT, and the batch
+        # in a single transaction. Highlights are created once
+        # the batch has committed.
+        self.assertEqual(
+            ["savepoint", "commit", "savepoint", "commit", "commit",
+             "highlight", "highlight", "close"],
+            self.db_session.events)
+
+    def test_failed_job(self):
+        persisters = [
+            self.create_persister(1, Exception("failed")),
+            self.create_persister(2)]
+        BatchTestChatBatchPersister(self.db_session, persisters).persist()
+
+        # Only the failed job is rolled back and aborted
+        self.assertEqual(["persist", "abort"], persisters[0].calls)
+        self.assertEqual(self.PERSISTED, persisters[1].calls)
+        self.assertEqual(
+            ["savepoint", "rollback", "savepoint", "commit",
+             "savepoint", "commit", "commit", "highlight", "close"],
+            self.db_session.events)
+
+    def test_duplicate_job(self):
+        persisters = [
+            self.create_persister(1, DuplicatePersistJobException()),
+            self.create_persister(2)]
+        BatchTestChatBatchPersister(self.db_session, persisters).persist()
+
+        # Jobs reclaimed by another owner are rolled back, not aborted
+        self.assertEqual(["persist"], persisters[0].calls)
+        self.assertEqual(self.PERSISTED, persisters[1].calls)
+
+    def test_missing_job_context(self):
+        persisters = [
+            self.create_persister(1, context=False),
+            self.create_persister(2)]
+        BatchTestChatBatchPersister(self.db_session, persisters).persist()
+
+        # Only the job without a context is aborted
+        self.assertEqual(["abort"], persisters[0].calls)
+        self.assertEqual(self.PERSISTED, persisters[1].calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
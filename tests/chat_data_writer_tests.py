@@ -0,0 +1,148 @@
+import datetime
+import os
+import sys
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+from chat_data_writer import ChatDataWriter
+
+
+class WriterTestCursor(object):
+    """
+        Stand-in for a psycopg2 cursor which records the
+        statements executed and returns minute ids.
+    """
+    def __init__(self):
+        self.statements = []
+        self.copied = []
+        self.returned = []
+        self.closed = False
+
+    def mogrify(self, sql, values):
+        return sql % tuple(repr(value) for value in values)
+
+    def execute(self, sql):
+        self.statements.append(sql)
+
+    def copy_expert(self, sql, buffer):
+        self.statements.append(sql)
+        self.copied.append(buffer.read())
+
+    def fetchall(self):
+        returned, self.returned = self.returned, []
+        return returned
+
+    def close(self):
+        self.closed = True
+
+
+class WriterTestConnection(object):
+    def __init__(self, cursor):
+        self.connection = self
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+class WriterTestSession(object):
+    """
+        Stand-in for a db session exposing a single cursor.
+    """
+    def __init__(self, cursor):
+        self._connection = WriterTestConnection(cursor)
+        self.num_flushes = 0
+
+    def flush(self):
+        self.num_flushes += 1
+
+    def connection(self):
+        return self._connection
+
+
+class ChatDataWriterTest(unittest.TestCase):
+    """
+        Test the ChatDataWriter class
+    """
+
+    def setUp(self):
+        start = datetime.datetime(2012, 6, 1, 12, 0, 0)
+        end = start + datetime.timedelta(minutes=1)
+        self.rows = {
+            "minutes": [
+                {"topic_id": 10, "start": start, "end": end},
+                {"topic_id": 11, "start": end, "end": end}],
+            "markers": [
+                {"topic_id": 10, "user_id": 1, "start": start, "end": end},
+                {"topic_id": 11, "user_id": 2, "start": end, "end": end},
+                {"topic_id": 11, "user_id": 1, "start": end, "end": end}],
+            "tags": [
+                {"topic_id": 11, "user_id": 1, "time": end, "tag_id": None,
+                 "name": "tag", "deleted": False}]
+        }
+
+    def test_write(self):
+        cursor = WriterTestCursor()
+        cursor.returned = [(101, 10), (102, 11)]
+        db_session = WriterTestSession(cursor)
+
+        ChatDataWriter().write(db_session, 1, self.rows)
+        self.assertEqual(1, db_session.num_flushes)
+        self.assertTrue(cursor.closed)
+
+        # One statement each for minutes, markers, and tags
+        self.assertEqual(3, len(cursor.statements))
+        self.assertIn("RETURNING", cursor.statements[0])
+
+        # Markers and tags reference the returned minute ids
+        self.assertEqual(1, cursor.statements[1].count("101"))
+        self.assertEqual(2, cursor.statements[1].count("102"))
+        self.assertIn("102", cursor.statements[2])
+
+    def test_write_pages(self):
+        cursor = WriterTestCursor()
+        cursor.returned = [(101, 10), (102, 11)]
+        db_session = WriterTestSession(cursor)
+
+        # Minutes and markers are split into pages of 2 rows
+        ChatDataWriter(page_size=2).write(db_session, 1, self.rows)
+        self.assertEqual(4, len(cursor.statements))
+
+    def test_write_copy(self):
+        cursor = WriterTestCursor()
+        cursor.returned = [(101, 10), (102, 11)]
+        db_session = WriterTestSession(cursor)
+
+        # Markers are copied, the single tag is inserted
+        ChatDataWriter(copy_threshold=2).write(db_session, 1, self.rows)
+        self.assertEqual(3, len(cursor.statements))
+        self.assertTrue(cursor.statements[1].startswith("COPY"))
+        self.assertFalse(cursor.statements[2].startswith("COPY"))
+
+        lines = cursor.copied[0].splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(["1", "101", "2012-06-01T12:00:00", "2012-06-01T12:01:00"],
+                         lines[0].split("\t"))
+
+    def test_copy_value(self):
+        writer = ChatDataWriter()
+        self.assertEqual("\\N", writer._copy_value(None))
+        self.assertEqual("t", writer._copy_value(True))
+        self.assertEqual("f", writer._copy_value(False))
+        self.assertEqual("12", writer._copy_value(12))
+        self.assertEqual("a\\tb\\nc\\\\d", writer._copy_value(u"a\tb\nc\\d"))
+
+    def test_write_empty(self):
+        cursor = WriterTestCursor()
+        db_session = WriterTestSession(cursor)
+
+        ChatDataWriter().write(db_session, 1, {"minutes": [], "markers": [], "tags": []})
+        self.assertEqual([], cursor.statements)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+import datetime
+import logging
+import os
+import sys
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+from sqlalchemy.sql import text
+from trpycore.timezone import tz
+from trsvcscore.db.models import Chat, ChatPersistJob, ChatSession, Topic
+
+from chat_persist_job_monitor import ChatPersistJobMonitor
+from testbase import IntegrationTestCase
+
+
+class ChatPersistJobClaimTest(IntegrationTestCase):
+    """
+        Test the ChatPersistJobMonitor claim statements against the db.
+
+        The persist service started by IntegrationTestCase claims
+        jobs from the same db, so the test jobs are given start
+        times a day in the future, which the service will not
+        claim, and are claimed as of that future time. Claims
+        are restricted to the test chat sessions by using
+        buckets which each hold a single chat session id.
+    """
+
+    # Number of buckets, larger than any chat session id,
+    # so each bucket holds a single chat session.
+    NUM_BUCKETS = 2147483647
+
+    LEASE_SECONDS = 300
+
+    def setUp(self):
+        self.now = tz.utcnow() + datetime.timedelta(days=1)
+        self.test_user_id = 1
+
+        self.root_topic = Topic(
+            parent_id=None,
+            rank=0,
+            title="ClaimTestChat",
+            description="Chat topic used to test claiming persist jobs",
+            duration=60, # secs
+            public=True,
+            active=True,
+            recommended_participants=1,
+            user_id=self.test_user_id,
+            type_id=1
+        )
+        self.chat = Chat(
+            type_id=1,
+            topic=self.root_topic,
+            start=tz.utcnow(),
+            end=tz.utcnow()+datetime.timedelta(minutes=5))
+        self.chat_sessions = [
+            ChatSession(chat=self.chat, token="claim_test_token_%d" % i, participants=1)
+            for i in range(4)]
+        self.jobs = []
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            db_session.add(self.root_topic)
+            db_session.add(self.chat)
+            for chat_session in self.chat_sessions:
+                db_session.add(chat_session)
+            db_session.commit()
+            self.chat_session_ids = [chat_session.id for chat_session in self.chat_sessions]
+        finally:
+            db_session.close()
+
+    def tearDown(self):
+        db_session = self.service.handler.get_database_session()
+        try:
+            for job in self.jobs:
+                db_session.delete(job)
+            db_session.flush()
+            for chat_session in self.chat_sessions:
+                db_session.delete(chat_session)
+            db_session.delete(self.chat)
+            db_session.delete(self.root_topic)
+            db_session.commit()
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            db_session.close()
+
+    def create_job(self, chat_session_id, created_minutes, start_minutes=-1,
+            owner=None, successful=None):
+        """Create a ChatPersistJob.
+
+        Args:
+            chat_session_id: chat session id of the job
+            created_minutes: creation time, in minutes relative to now
+            start_minutes: start time, in minutes relative to now
+            owner: optional job owner
+            successful: optional job status
+        Returns:
+            job id
+        """
+        job = ChatPersistJob(
+            chat_session_id=chat_session_id,
+            created=self.now + datetime.timedelta(minutes=created_minutes),
+            start=self.now + datetime.timedelta(minutes=start_minutes),
+            owner=owner,
+            successful=successful)
+        if successful is not None:
+            job.end = job.start
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            db_session.add(job)
+            db_session.commit()
+            self.jobs.append(job)
+            return job.id
+        finally:
+            db_session.close()
+
+    def claim(self, db_session, limit, chat_session_ids=None, now=None):
+        """Claim jobs of the test chat sessions.
+
+        Args:
+            db_session: sqlalchemy db session in which jobs are claimed
+            limit: maximum number of jobs to claim
+            chat_session_ids: optional list of chat session ids to
+                claim jobs from. Defaults to all test chat sessions.
+            now: optional time of the claim. Defaults to self.now.
+        Returns:
+            list of claimed (job_id, priority, previous_owner) tuples,
+            in claim order.
+        """
+        now = now or self.now
+        chat_session_ids = chat_session_ids or self.chat_session_ids
+        jobs = []
+        for priority, claim_jobs_sql in ChatPersistJobMonitor.CLAIM_LANES:
+            if len(jobs) >= limit:
+                break
+            result = db_session.execute(claim_jobs_sql, {
+                "owner": "claim-test",
+                "start": now,
+                "lease_expired": now - datetime.timedelta(seconds=self.LEASE_SECONDS),
+                "limit": limit - len(jobs),
+                "all_buckets": False,
+                "num_buckets": self.NUM_BUCKETS,
+                "buckets": chat_session_ids
+            })
+            jobs.extend((priority, row.created, row.id, row.previous_owner) for row in result)
+        jobs.sort()
+        return [(job_id, priority, previous_owner)
+                for priority, created, job_id, previous_owner in jobs]
+
+    def test_claim_oldest_first(self):
+        newer_job_id = self.create_job(self.chat_session_ids[0], -1)
+        older_job_id = self.create_job(self.chat_session_ids[1], -3)
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            jobs = self.claim(db_session, 1)
+            self.assertEqual([older_job_id], [job[0] for job in jobs])
+            jobs = self.claim(db_session, 10)
+            self.assertEqual([newer_job_id], [job[0] for job in jobs])
+
+            # Claimed jobs are owned and started
+            job = db_session.query(ChatPersistJob).get(newer_job_id)
+            self.assertEqual("claim-test", job.owner)
+            self.assertEqual(self.now, job.start)
+        finally:
+            db_session.rollback()
+            db_session.close()
+
+    def test_claim_rerun_lane(self):
+        # A rerun of a failed job is claimed after newer interactive jobs
+        self.create_job(self.chat_session_ids[0], -10, successful=False)
+        rerun_job_id = self.create_job(self.chat_session_ids[0], -5)
+        job_id = self.create_job(self.chat_session_ids[1], -1)
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            jobs = self.claim(db_session, 10)
+            self.assertEqual([
+                (job_id, ChatPersistJobMonitor.PRIORITY_INTERACTIVE, None),
+                (rerun_job_id, ChatPersistJobMonitor.PRIORITY_RERUN, None)],
+                jobs)
+        finally:
+            db_session.rollback()
+            db_session.close()
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            jobs = self.claim(db_session, 1)
+            self.assertEqual([job_id], [job[0] for job in jobs])
+        finally:
+            db_session.rollback()
+            db_session.close()
+
+    def test_claim_skip_locked(self):
+        locked_job_id = self.create_job(self.chat_session_ids[0], -3)
+        job_id = self.create_job(self.chat_session_ids[1], -1)
+
+        locking_session = self.service.handler.get_database_session()
+        db_session = self.service.handler.get_database_session()
+        try:
+            locking_session.execute(
+                text("SELECT id FROM chat_persist_job WHERE id = :id FOR UPDATE"),
+                {"id": locked_job_id})
+
+            # Fail, rather than hang, if the claim waits on the lock
+            db_session.execute("SET LOCAL statement_timeout = 5000")
+            jobs = self.claim(db_session, 10)
+            self.assertEqual([job_id], [job[0] for job in jobs])
+        finally:
+            db_session.rollback()
+            db_session.close()
+            locking_session.rollback()
+            locking_session.close()
+
+    def test_claim_expired_lease(self):
+        lease_minutes = self.LEASE_SECONDS / 60
+        expired_job_id = self.create_job(self.chat_session_ids[0], -20,
+                start_minutes=-lease_minutes - 1, owner="expired-owner")
+        self.create_job(self.chat_session_ids[1], -20,
+                start_minutes=-lease_minutes + 1, owner="live-owner")
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            jobs = self.claim(db_session, 10)
+            self.assertEqual([(expired_job_id,
+                ChatPersistJobMonitor.PRIORITY_INTERACTIVE,
+                "expired-owner")], jobs)
+        finally:
+            db_session.rollback()
+            db_session.close()
+
+    def test_claim_retry_start(self):
+        # Retries are not claimed before their start time
+        retry_job_id = self.create_job(self.chat_session_ids[0], -5, start_minutes=1)
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            self.assertEqual([], self.claim(db_session, 10))
+            jobs = self.claim(db_session, 10,
+                    now=self.now + datetime.timedelta(minutes=2))
+            self.assertEqual([retry_job_id], [job[0] for job in jobs])
+        finally:
+            db_session.rollback()
+            db_session.close()
+
+    def test_claim_buckets(self):
+        self.create_job(self.chat_session_ids[0], -3)
+        job_id = self.create_job(self.chat_session_ids[1], -1)
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            jobs = self.claim(db_session, 10, chat_session_ids=self.chat_session_ids[1:])
+            self.assertEqual([job_id], [job[0] for job in jobs])
+        finally:
+            db_session.rollback()
+            db_session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
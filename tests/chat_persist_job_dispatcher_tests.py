@@ -0,0 +1,99 @@
+import os
+import sys
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+from chat_persist_job_dispatcher import ChatPersistJobDispatcher
+from zookeeper_test_client import ZookeeperTestClient, ZookeeperTestServer
+
+
+class ChatPersistJobDispatcherTest(unittest.TestCase):
+    """
+        Test the ChatPersistJobDispatcher class using an
+        in-process ZooKeeper stand-in.
+    """
+
+    def setUp(self):
+        self.server = ZookeeperTestServer()
+        self.changes = []
+        self.dispatchers = []
+
+    def tearDown(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.stop()
+
+    def create_dispatcher(self, name):
+        dispatcher = ChatPersistJobDispatcher(
+                ZookeeperTestClient(self.server),
+                "/persistsvc/dispatch",
+                name,
+                change_callback=lambda: self.changes.append(name))
+        dispatcher.start()
+        self.dispatchers.append(dispatcher)
+        return dispatcher
+
+    def test_single_leader(self):
+        dispatcher1 = self.create_dispatcher("node1")
+        dispatcher2 = self.create_dispatcher("node2")
+        dispatcher3 = self.create_dispatcher("node3")
+        self.assertTrue(dispatcher1.is_leader())
+        self.assertFalse(dispatcher2.is_leader())
+        self.assertFalse(dispatcher3.is_leader())
+
+    def test_leader_failover(self):
+        dispatcher1 = self.create_dispatcher("node1")
+        dispatcher2 = self.create_dispatcher("node2")
+        self.assertTrue(dispatcher1.is_leader())
+
+        # Remaining member is notified and takes over
+        dispatcher1.zookeeper_client.expire_session()
+        self.assertIn("node2", self.changes)
+        self.assertTrue(dispatcher2.is_leader())
+
+        # Expired member rejoins as a follower
+        self.assertFalse(dispatcher1.is_leader())
+
+    def test_leader_stop(self):
+        dispatcher1 = self.create_dispatcher("node1")
+        dispatcher2 = self.create_dispatcher("node2")
+        dispatcher1.stop()
+        self.assertFalse(dispatcher1.is_leader())
+        self.assertTrue(dispatcher2.is_leader())
+
+    def test_publish_take(self):
+        dispatcher1 = self.create_dispatcher("node1")
+        dispatcher2 = self.create_dispatcher("node2")
+
+        dispatcher1.publish([(3, 0, None), (1, 1, None), (2, 1, None)])
+        self.assertEqual(3, dispatcher1.queue_size())
+        self.assertEqual([1, 2, 3], sorted(dispatcher2.get_queued_job_ids()))
+
+        # Jobs are taken in the order they were published,
+        # and each job is taken only once.
+        self.assertEqual([(3, 0), (1, 1)], dispatcher2.take(2))
+        self.assertEqual([(2, 1)], dispatcher1.take(2))
+        self.assertEqual([], dispatcher2.take(2))
+        self.assertEqual(0, dispatcher1.queue_size())
+
+    def test_publish_notifies_consumers(self):
+        dispatcher1 = self.create_dispatcher("node1")
+        dispatcher2 = self.create_dispatcher("node2")
+        dispatcher2.take(1)
+        del self.changes[:]
+
+        dispatcher1.publish([(1, 0, None)])
+        self.assertIn("node2", self.changes)
+
+    def test_empty_queue(self):
+        dispatcher = self.create_dispatcher("node1")
+        self.assertEqual(0, dispatcher.queue_size())
+        self.assertEqual([], dispatcher.get_queued_job_ids())
+        self.assertEqual([], dispatcher.take(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
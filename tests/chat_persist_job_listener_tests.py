@@ -0,0 +1,254 @@
+import os
+import socket
+import sys
+import time
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+from chat_persist_job_listener import ChatPersistJobListener
+from chat_persist_job_monitor import ChatPersistJobMonitor
+
+
+class ListenerTestConnection(object):
+    """
+        Stand-in for a psycopg2 connection. Notifications
+        are delivered by writing to a pipe, which makes the
+        connection readable, and errors are raised from poll().
+    """
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.notifies = []
+        self.statements = []
+        self.error = None
+        self.closed = False
+
+    def fileno(self):
+        return self.read_fd
+
+    def notify(self, payload="1"):
+        os.write(self.write_fd, payload)
+
+    def fail(self):
+        self.error = Exception("connection lost")
+        os.write(self.write_fd, "x")
+
+    def poll(self):
+        payload = os.read(self.read_fd, 1024)
+        if self.error:
+            raise self.error
+        self.notifies.extend(payload)
+
+    def set_isolation_level(self, level):
+        pass
+
+    def cursor(self):
+        return ListenerTestCursor(self)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+
+
+class ListenerTestCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql):
+        self.connection.statements.append(sql)
+
+    def close(self):
+        pass
+
+
+class ListenerTestPoolConnection(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def detach(self):
+        pass
+
+
+class ListenerTestSession(object):
+    """
+        Stand-in for a db session, whose bind
+        hands out the factory's next connection.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+
+    def get_bind(self):
+        return self
+
+    def raw_connection(self):
+        return ListenerTestPoolConnection(self.factory.connect())
+
+    def close(self):
+        pass
+
+
+class ListenerTestSessionFactory(object):
+    """
+        Callable returning db sessions. Connect
+        attempts fail while available is False.
+    """
+    def __init__(self):
+        self.available = True
+        self.connections = []
+
+    def __call__(self):
+        return ListenerTestSession(self)
+
+    def connect(self):
+        if not self.available:
+            raise Exception("db unavailable")
+        connection = ListenerTestConnection()
+        self.connections.append(connection)
+        return connection
+
+
+class ChatPersistJobListenerTest(unittest.TestCase):
+    """
+        Test the ChatPersistJobListener class
+    """
+
+    def setUp(self):
+        self.factory = ListenerTestSessionFactory()
+        self.callbacks = 0
+        self.listener = ChatPersistJobListener(
+                self.factory, "chat_persist_job", self.callback,
+                reconnect_seconds=0.05)
+
+    def tearDown(self):
+        self.listener.stop()
+        self.listener.join(5)
+        for connection in self.factory.connections:
+            connection.close()
+
+    def callback(self):
+        self.callbacks += 1
+
+    def wait_for(self, predicate, timeout=5):
+        end = time.time() + timeout
+        while not predicate() and time.time() < end:
+            time.sleep(0.01)
+        return predicate()
+
+    def test_connect(self):
+        self.assertFalse(self.listener.is_connected())
+        self.listener.start()
+        self.assertTrue(self.wait_for(self.listener.is_connected))
+
+        # The callback is invoked on connect, since notifications
+        # may have been missed while disconnected.
+        self.assertTrue(self.wait_for(lambda: self.callbacks == 1))
+        self.assertEqual(['LISTEN "chat_persist_job";'],
+                         self.factory.connections[0].statements)
+
+    def test_notify(self):
+        self.listener.start()
+        self.assertTrue(self.wait_for(lambda: self.callbacks == 1))
+
+        self.factory.connections[0].notify()
+        self.assertTrue(self.wait_for(lambda: self.callbacks == 2))
+        self.assertEqual([], self.factory.connections[0].notifies)
+
+    def test_reconnect(self):
+        self.listener.start()
+        self.assertTrue(self.wait_for(lambda: self.callbacks == 1))
+
+        # Losing the connection disconnects the listener
+        # until a new connection can be made.
+        self.factory.available = False
+        self.factory.connections[0].fail()
+        self.assertTrue(self.wait_for(lambda: not self.listener.is_connected()))
+        self.assertTrue(self.factory.connections[0].closed)
+
+        self.factory.available = True
+        self.assertTrue(self.wait_for(self.listener.is_connected))
+        self.assertTrue(self.wait_for(lambda: self.callbacks == 2))
+        self.assertEqual(2, len(self.factory.connections))
+
+    def test_stop(self):
+        self.listener.start()
+        self.assertTrue(self.wait_for(self.listener.is_connected))
+        self.listener.stop()
+        self.listener.join(5)
+        self.assertFalse(self.listener.is_connected())
+        self.assertTrue(self.factory.connections[0].closed)
+
+
+
+class ChatPersistJobListenerKeepaliveTest(unittest.TestCase):
+    """
+        Test TCP keepalives are enabled on the listen connection.
+    """
+
+    def test_keepalive(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        client = socket.create_connection(server.getsockname())
+        accepted, address = server.accept()
+        listener = ChatPersistJobListener(None, "chat_persist_job", None)
+        try:
+            listener.connection = client
+            listener._enable_keepalive()
+            self.assertTrue(client.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                self.assertEqual(60, client.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE))
+        finally:
+            accepted.close()
+            client.close()
+            server.close()
+
+
+class ChatPersistJobMonitorPollTest(unittest.TestCase):
+    """
+        Test the ChatPersistJobMonitor poll interval
+        falls back to polling without notifications.
+    """
+
+    def wait_for(self, predicate, timeout=5):
+        end = time.time() + timeout
+        while not predicate() and time.time() < end:
+            time.sleep(0.01)
+        return predicate()
+
+    def test_without_listener(self):
+        monitor = ChatPersistJobMonitor(1, None, "localhost",
+                poll_seconds=60, notify_poll_seconds=600)
+        self.assertIsNone(monitor.listener)
+        self.assertEqual(60, monitor._get_poll_seconds())
+
+    def test_poll_fallback(self):
+        self.factory = ListenerTestSessionFactory()
+        monitor = ChatPersistJobMonitor(1, self.factory, "localhost",
+                poll_seconds=60, notify_channel="chat_persist_job",
+                notify_poll_seconds=600)
+        listener = monitor.listener
+        listener.reconnect_seconds = 0.05
+        try:
+            # Poll every poll_seconds until notifications are received
+            self.factory.available = False
+            self.assertEqual(60, monitor._get_poll_seconds())
+            listener.start()
+            self.assertEqual(60, monitor._get_poll_seconds())
+
+            self.factory.available = True
+            self.assertTrue(self.wait_for(listener.is_connected))
+            self.assertEqual(600, monitor._get_poll_seconds())
+        finally:
+            listener.stop()
+            listener.join(5)
+            for connection in self.factory.connections:
+                connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import os
+import sys
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+from chat_persist_job_monitor import ChatPersistJobPollInterval, \
+    ChatPersistJobTracker, ChatPersisterThreadPool, ChatPersistJobMonitor
+from persister import ChatPersister
+
+
+class ChatPersistJobPollIntervalTest(unittest.TestCase):
+    """
+        Test the ChatPersistJobPollInterval class
+    """
+
+    def test_backoff(self):
+        interval = ChatPersistJobPollInterval(1)
+        self.assertEqual(1, interval.get())
+
+        # Back off step by step up to the maximum
+        expected_intervals = [2, 4, 8, 10, 10]
+        for expected_interval in expected_intervals:
+            interval.backoff(10)
+            self.assertEqual(expected_interval, interval.get())
+
+        # Maximum may shrink (e.g. listen connection dropped)
+        interval.backoff(5)
+        self.assertEqual(5, interval.get())
+
+    def test_reset(self):
+        interval = ChatPersistJobPollInterval(1)
+        interval.backoff(60)
+        interval.backoff(60)
+        interval.reset()
+        self.assertEqual(1, interval.get())
+
+
+class ChatPersistJobTrackerTest(unittest.TestCase):
+    """
+        Test the ChatPersistJobTracker class
+    """
+
+    def test_duplicate_jobs(self):
+        tracker = ChatPersistJobTracker()
+        self.assertTrue(tracker.add(1))
+        self.assertFalse(tracker.add(1))
+        self.assertEqual(1, tracker.queued_count())
+
+        # Job remains tracked while in-flight
+        tracker.start(1)
+        self.assertFalse(tracker.add(1))
+        self.assertEqual(0, tracker.queued_count())
+        self.assertEqual(1, tracker.running_count())
+
+        tracker.finish(1)
+        self.assertEqual(0, tracker.count())
+        self.assertTrue(tracker.add(1))
+
+    def test_finish_callback(self):
+        finished = []
+        tracker = ChatPersistJobTracker(finished.append)
+        tracker.add(1)
+        tracker.start(1)
+        tracker.finish(1)
+        self.assertEqual([1], finished)
+
+
+class ChatPersisterThreadPoolTest(unittest.TestCase):
+    """
+        Test the ChatPersisterThreadPool class
+    """
+
+    def test_resize(self):
+        threadpool = ChatPersisterThreadPool(
+                1, None, ChatPersistJobTracker(), "owner", max_threads=4)
+        self.assertEqual(1, threadpool.get_size())
+
+        # Size is limited to [num_threads, max_threads]
+        self.assertEqual(3, threadpool.resize(3))
+        self.assertEqual(4, threadpool.resize(10))
+        self.assertEqual(1, threadpool.resize(0))
+
+    def test_fixed_size(self):
+        threadpool = ChatPersisterThreadPool(
+                2, None, ChatPersistJobTracker(), "owner")
+        self.assertEqual(2, threadpool.resize(4))
+
+    def test_batch(self):
+        threadpool = ChatPersisterThreadPool(
+                1, None, ChatPersistJobTracker(), "owner", batch_size=2)
+        threadpool.job_queue.put((1, 2, 10))
+        threadpool.job_queue.put((0, 3, 11))
+        threadpool.job_queue.put((1, 1, 12))
+
+        # Batches are taken highest priority, then oldest, first
+        self.assertEqual([11, 12], threadpool._get_job_ids())
+        self.assertEqual([10], threadpool._get_job_ids())
+        self.assertEqual([], threadpool._get_job_ids())
+
+    def test_stop(self):
+        job_tracker = ChatPersistJobTracker()
+        threadpool = ChatPersisterThreadPool(1, None, job_tracker, "owner")
+        job_tracker.add(10)
+        threadpool.job_queue.put((0, 1, 10))
+        threadpool.stop()
+
+        # Jobs are not started once stopped, and remain
+        # queued in the tracker to be released.
+        threadpool.process(ChatPersisterThreadPool.JOB_TOKEN)
+        self.assertEqual([10], job_tracker.get_queued_job_ids())
+        self.assertEqual(0, job_tracker.running_count())
+
+
+class MonitorTestComputePool(object):
+    """
+        Stand-in for a multiprocessing Pool which
+        records the calls made to it.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def terminate(self):
+        self.calls.append("terminate")
+
+    def join(self):
+        self.calls.append("join")
+
+
+class MonitorTestSession(object):
+    """
+        Stand-in for a db session.
+    """
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MonitorTestChatPersistJobMonitor(ChatPersistJobMonitor):
+    """
+        ChatPersistJobMonitor which is stopped while claiming
+        its first jobs, and records the jobs it releases.
+    """
+    def __init__(self, claimed_jobs, **kwargs):
+        super(MonitorTestChatPersistJobMonitor, self).__init__(
+                1, MonitorTestSession, "localhost", **kwargs)
+        self.claimed_jobs = claimed_jobs
+        self.released_job_ids = []
+
+    def _claim_jobs(self, session, limit, owner=None):
+        self.stop()
+        return self.claimed_jobs
+
+    def _release_jobs(self, job_ids):
+        self.released_job_ids.extend(job_ids)
+
+
+class ChatPersistJobMonitorTest(unittest.TestCase):
+    """
+        Test the ChatPersistJobMonitor class
+    """
+
+    def test_owner(self):
+        monitor = ChatPersistJobMonitor(1, None, "localhost")
+        self.assertEqual("localhost:%d:%s" % (os.getpid(), monitor.monitorThread.name),
+                monitor.owner)
+
+        # Long hostnames are truncated so owners fit the owner column
+        monitor = ChatPersistJobMonitor(1, None, "host" * 50)
+        self.assertEqual(ChatPersister.OWNER_MAX_LENGTH, len(monitor.dispatch_owner))
+        self.assertTrue(monitor.owner.endswith(
+            ":%d:%s" % (os.getpid(), monitor.monitorThread.name)))
+
+        persister = ChatPersister(None, 1, monitor.owner)
+        self.assertTrue(len(persister.DEAD_LETTER_OWNER_PREFIX +
+            persister._get_worker_owner()) <= ChatPersister.OWNER_MAX_LENGTH)
+
+    def test_release_jobs_claimed_while_stopping(self):
+        # Jobs claimed by the monitor thread while it is
+        # being stopped are released once it exits.
+        monitor = MonitorTestChatPersistJobMonitor([(10, 0, 1), (11, 1, 2)])
+        monitor.start()
+        monitor.monitorThread.join(5)
+        self.assertFalse(monitor.monitorThread.is_alive())
+        self.assertEqual([10, 11], sorted(monitor.released_job_ids))
+        self.assertTrue(monitor.threadpool.is_stopped())
+
+    def test_join_compute_pool_after_stop(self):
+        compute_pool = MonitorTestComputePool()
+        monitor = MonitorTestChatPersistJobMonitor([],
+                compute_pool=compute_pool)
+
+        # The worker processes are left running until stopped
+        monitor.running = True
+        monitor.join(1)
+        self.assertEqual([], compute_pool.calls)
+        monitor.running = False
+
+        monitor.start()
+        monitor.monitorThread.join(5)
+        monitor.join(1)
+        self.assertEqual(["terminate", "join"], compute_pool.calls)
+
+        # and are only terminated once
+        monitor.join(1)
+        self.assertEqual(["terminate", "join"], compute_pool.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import sys
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+from chat_persist_job_partitioner import ChatPersistJobPartitioner, \
+    ConsistentHashRing
+from zookeeper_test_client import ZookeeperTestClient, ZookeeperTestServer
+
+
+class ConsistentHashRingTest(unittest.TestCase):
+    """
+        Test the ConsistentHashRing class
+    """
+
+    def test_empty(self):
+        ring = ConsistentHashRing()
+        self.assertIsNone(ring.get(1))
+
+    def test_distribution(self):
+        ring = ConsistentHashRing(["a", "b", "c"])
+        owners = [ring.get(key) for key in range(300)]
+        for member in ["a", "b", "c"]:
+            self.assertGreater(owners.count(member), 50)
+
+    def test_minimal_remap(self):
+        ring = ConsistentHashRing(["a", "b", "c"])
+        before = dict((key, ring.get(key)) for key in range(300))
+        ring.remove("c")
+        after = dict((key, ring.get(key)) for key in range(300))
+
+        # Only keys which belonged to the removed member move
+        for key in range(300):
+            if before[key] != "c":
+                self.assertEqual(before[key], after[key])
+            else:
+                self.assertIn(after[key], ["a", "b"])
+
+
+class ChatPersistJobPartitionerTest(unittest.TestCase):
+    """
+        Test the ChatPersistJobPartitioner class using an
+        in-process ZooKeeper stand-in.
+    """
+
+    def setUp(self):
+        self.server = ZookeeperTestServer()
+        self.changes = []
+        self.partitioners = []
+
+    def tearDown(self):
+        for partitioner in self.partitioners:
+            partitioner.stop()
+
+    def create_partitioner(self, name):
+        partitioner = ChatPersistJobPartitioner(
+                ZookeeperTestClient(self.server),
+                "/persistsvc/partition",
+                name,
+                num_buckets=16,
+                change_callback=lambda: self.changes.append(name))
+        partitioner.start()
+        self.partitioners.append(partitioner)
+        return partitioner
+
+    def assertPartitioned(self, partitioners, num_buckets=16):
+        owned = []
+        for partitioner in partitioners:
+            owned.extend(partitioner.get_buckets())
+        self.assertEqual(range(num_buckets), sorted(owned))
+
+    def test_single_member(self):
+        partitioner = self.create_partitioner("node1")
+        self.assertEqual(range(16), partitioner.get_buckets())
+
+    def test_not_started(self):
+        partitioner = ChatPersistJobPartitioner(
+                ZookeeperTestClient(self.server),
+                "/persistsvc/partition",
+                "node1")
+        self.assertIsNone(partitioner.get_buckets())
+
+    def test_member_join(self):
+        partitioner1 = self.create_partitioner("node1")
+        self.assertEqual(16, len(partitioner1.get_buckets()))
+
+        partitioner2 = self.create_partitioner("node2")
+        partitioner2.get_buckets()
+
+        # Existing member is notified and rebalances
+        self.assertIn("node1", self.changes)
+        self.assertPartitioned([partitioner1, partitioner2])
+        self.assertLess(len(partitioner1.get_buckets()), 16)
+
+    def test_member_leave(self):
+        partitioner1 = self.create_partitioner("node1")
+        partitioner2 = self.create_partitioner("node2")
+        partitioner3 = self.create_partitioner("node3")
+        self.assertPartitioned([partitioner1, partitioner2, partitioner3])
+
+        partitioner3.stop()
+        self.assertPartitioned([partitioner1, partitioner2])
+
+    def test_session_expired(self):
+        partitioner1 = self.create_partitioner("node1")
+        partitioner2 = self.create_partitioner("node2")
+        self.assertPartitioned([partitioner1, partitioner2])
+
+        # Expired member re-registers on next use
+        partitioner2.zookeeper_client.expire_session()
+        self.assertEqual(range(16), partitioner1.get_buckets())
+        partitioner2.get_buckets()
+        self.assertPartitioned([partitioner1, partitioner2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -256,7 +256,7 @@ class DistributedPersistServiceTest(DistributedTestCase):
 
             # Verify job start
             self.assertIsNotNone(chat_persist_job.start)
-            self.assertEqual('persistsvc', chat_persist_job.owner)
+            self.assertTrue(chat_persist_job.owner.startswith(self.service.hostname()))
 
             # Verify job end
             self.assertIsNotNone(chat_persist_job.end)
@@ -0,0 +1,82 @@
+import os
+import sys
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+from lookup_cache import LookupCache
+
+
+class LookupTestModel(object):
+    """
+        Stand-in for a lookup table model.
+    """
+    id = "id"
+    name = "name"
+
+
+class LookupTestQuery(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return list(self.rows)
+
+
+class LookupTestSession(object):
+    """
+        Stand-in for a db session holding a single lookup table.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.num_queries = 0
+
+    def query(self, *columns):
+        self.num_queries += 1
+        return LookupTestQuery(self.rows)
+
+
+class LookupCacheTest(unittest.TestCase):
+    """
+        Test the LookupCache class
+    """
+
+    def test_get_id(self):
+        db_session = LookupTestSession([("THRIFT_BINARY", 1), ("THRIFT_BINARY_B64", 2)])
+        cache = LookupCache([LookupTestModel])
+
+        # Loaded on first use, and only once
+        self.assertEqual(2, cache.get_id(db_session, LookupTestModel, "THRIFT_BINARY_B64"))
+        self.assertEqual([1, 2], cache.get_ids(db_session, LookupTestModel,
+            ["THRIFT_BINARY", "THRIFT_BINARY_B64"]))
+        self.assertEqual(1, db_session.num_queries)
+
+    def test_missing_id(self):
+        db_session = LookupTestSession([("THRIFT_BINARY", 1)])
+        cache = LookupCache([LookupTestModel])
+        cache.load(db_session)
+
+        # Reloaded in case the row was added since loading
+        db_session.rows.append(("THRIFT_BINARY_B64", 2))
+        self.assertEqual(2, cache.get_id(db_session, LookupTestModel, "THRIFT_BINARY_B64"))
+        self.assertEqual(2, db_session.num_queries)
+
+        with self.assertRaises(KeyError):
+            cache.get_id(db_session, LookupTestModel, "JSON")
+
+    def test_get_existing_ids(self):
+        db_session = LookupTestSession([("THRIFT_BINARY", 1), ("THRIFT_BINARY_B64", 2)])
+        cache = LookupCache([LookupTestModel])
+
+        # Missing rows are left out, without reloading the cache
+        for i in range(2):
+            self.assertEqual([2, 1], cache.get_existing_ids(db_session, LookupTestModel,
+                ["THRIFT_BINARY_B64", "JSON", "THRIFT_BINARY"]))
+        self.assertEqual(1, db_session.num_queries)
+
+
+if __name__ == '__main__':
+    unittest.main()
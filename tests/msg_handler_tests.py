@@ -10,8 +10,11 @@ SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SE
 sys.path.insert(0, SERVICE_ROOT)
 
 
+from trchatsvc.gen.ttypes import MessageType
+
 from chat_test_data import ChatTestDataSets
-from message_handler import ChatMessageHandler
+from message_handler import ChatMessageHandler, ChatMinuteData, \
+    ChatSpeakingMarkerData, ChatTagData
 from topic_test_data import TopicTestDataSets
 
 
@@ -55,6 +58,45 @@ class ChatMessageHandlerTest(unittest.TestCase):
         self.assertIsNotNone(handler.chat_minute_handler)
         self.assertIsNotNone(handler.chat_tag_handler)
 
+    def test_getMessageTypes(self):
+
+        # Whiteboard messages are not consumed
+        expected_message_types = sorted([
+            MessageType.MARKER_CREATE,
+            MessageType.MINUTE_CREATE,
+            MessageType.MINUTE_UPDATE,
+            MessageType.TAG_CREATE,
+            MessageType.TAG_DELETE
+        ])
+        self.assertEqual(expected_message_types, ChatMessageHandler.get_message_types())
+
+    def test_messageDispatch(self):
+
+        # Each consumed message type is dispatched to the
+        # handler method listed in MESSAGE_TYPES
+        chat_data = self.test_chat_datasets[0]
+        handler = ChatMessageHandler(chat_data.chat_session_id, chat_data.topic_collection)
+        self.assertEqual(ChatMessageHandler.get_message_types(),
+                         sorted(handler.message_handlers.keys()))
+        self.assertEqual(handler.chat_minute_handler.update_models,
+                         handler.message_handlers[MessageType.MINUTE_UPDATE])
+        self.assertEqual(handler.chat_tag_handler.delete_models,
+                         handler.message_handlers[MessageType.TAG_DELETE])
+
+    def test_finalizeRecords(self):
+
+        # Handlers return plain records rather than ORM models
+        record_types = (ChatMinuteData, ChatSpeakingMarkerData, ChatTagData)
+        for chat_data in self.test_chat_datasets:
+            handler = ChatMessageHandler(chat_data.chat_session_id, chat_data.topic_collection)
+            for message in chat_data.message_list:
+                handler.process(message)
+            models = handler.finalize()
+            self.assertTrue(len(models) > 0)
+            for model in models:
+                self.assertIsInstance(model, record_types)
+                self.assertFalse(hasattr(model, "__dict__"))
+
 
 
 
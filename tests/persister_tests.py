@@ -10,12 +10,14 @@ SERVICE_NAME = "persistsvc"
 SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
 sys.path.insert(0, SERVICE_ROOT)
 
+from sqlalchemy.sql import func
 from trpycore.timezone import tz
 from trsvcscore.db.models import Chat, ChatPersistJob, ChatSession, \
     ChatArchiveJob, ChatMessage, ChatMinute, ChatSpeakingMarker, \
     ChatTag, ChatHighlightSession, ChatUser, User, Topic
 
 from chat_test_data import ChatTestDataBuilder
+from persister import ChatPersister, ChatPersistJobContext
 from testbase import IntegrationTestCase
 
 import settings
@@ -253,7 +255,7 @@ class ChatPersisterTest(IntegrationTestCase):
 
         # Verify job start
         self.assertIsNotNone(chat_persist_job.start)
-        self.assertEqual('persistsvc', chat_persist_job.owner)
+        self.assertTrue(chat_persist_job.owner.startswith(self.service.hostname()))
 
         # Verify job end
         self.assertIsNotNone(chat_persist_job.end)
@@ -348,6 +350,300 @@ class ChatPersisterTest(IntegrationTestCase):
 #        pass
 
 
+class ChatPersisterRetryTest(IntegrationTestCase):
+    """
+        Test the retry of failed ChatPersistJobs.
+
+        Jobs are owned by the test, and retries are delayed by
+        an hour, so they are not claimed by the persist service.
+    """
+
+    OWNER = "retry-test"
+    RETRY_ATTEMPTS = 2
+    RETRY_SECONDS = 3600
+
+    def setUp(self):
+        self.test_user_id = 1
+        self.root_topic = Topic(
+            parent_id=None,
+            rank=0,
+            title="RetryTestChat",
+            description="Chat topic used to test persist job retries",
+            duration=60, # secs
+            public=True,
+            active=True,
+            recommended_participants=1,
+            user_id=self.test_user_id,
+            type_id=1
+        )
+        self.chat = Chat(
+            type_id=1,
+            topic=self.root_topic,
+            start=tz.utcnow(),
+            end=tz.utcnow()+datetime.timedelta(minutes=5))
+        self.chat_session = ChatSession(
+            chat=self.chat,
+            token="retry_test_dummy_token",
+            participants=1)
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            db_session.add(self.root_topic)
+            db_session.add(self.chat)
+            db_session.add(self.chat_session)
+            db_session.commit()
+            self.chat_session_id = self.chat_session.id
+        finally:
+            db_session.close()
+
+    def tearDown(self):
+        db_session = self.service.handler.get_database_session()
+        try:
+            db_session.query(ChatPersistJob).\
+                filter_by(chat_session_id=self.chat_session_id).\
+                delete()
+            db_session.delete(self.chat_session)
+            db_session.delete(self.chat)
+            db_session.delete(self.root_topic)
+            db_session.commit()
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            db_session.close()
+
+    def create_job(self):
+        """Create a ChatPersistJob owned by the test.
+
+        Returns:
+            job id
+        """
+        db_session = self.service.handler.get_database_session()
+        try:
+            job = ChatPersistJob(
+                chat_session_id=self.chat_session_id,
+                created=tz.utcnow(),
+                start=tz.utcnow(),
+                owner=self.OWNER)
+            db_session.add(job)
+            db_session.commit()
+            return job.id
+        finally:
+            db_session.close()
+
+    def claim_job(self, job_id):
+        """Claim a retry job on behalf of the test."""
+        db_session = self.service.handler.get_database_session()
+        try:
+            db_session.query(ChatPersistJob).\
+                filter_by(id=job_id).\
+                update({"owner": self.OWNER, "start": tz.utcnow()})
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def abort_job(self, job_id):
+        """Abort a job as if it failed.
+
+        Returns:
+            list of the chat session's ChatPersistJobs
+            ordered by id.
+        """
+        persister = ChatPersister(
+            self.service.handler.get_database_session,
+            job_id,
+            self.OWNER,
+            self.RETRY_ATTEMPTS,
+            self.RETRY_SECONDS)
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            persister._abort_chat_persist_job(db_session)
+            db_session.commit()
+            return db_session.query(ChatPersistJob).\
+                filter_by(chat_session_id=self.chat_session_id).\
+                order_by(ChatPersistJob.id).\
+                all()
+        finally:
+            db_session.close()
+
+    def assert_retry(self, job, retry_seconds):
+        self.assertIsNone(job.owner)
+        self.assertIsNone(job.successful)
+        self.assertEqual(retry_seconds, (job.start - job.created).total_seconds())
+
+    def test_get_retry_seconds(self):
+        persister = ChatPersister(None, 1, self.OWNER, 3, 60)
+        self.assertEqual(60, persister._get_retry_seconds(1))
+        self.assertEqual(120, persister._get_retry_seconds(2))
+        self.assertEqual(240, persister._get_retry_seconds(3))
+        self.assertIsNone(persister._get_retry_seconds(4))
+
+    def test_retry_backoff(self):
+        job_id = self.create_job()
+
+        # The delay doubles with each failure
+        jobs = self.abort_job(job_id)
+        self.assertEqual(2, len(jobs))
+        self.assertFalse(jobs[0].successful)
+        self.assert_retry(jobs[1], self.RETRY_SECONDS)
+
+        self.claim_job(jobs[1].id)
+        jobs = self.abort_job(jobs[1].id)
+        self.assertEqual(3, len(jobs))
+        self.assert_retry(jobs[2], 2 * self.RETRY_SECONDS)
+
+    def test_give_up(self):
+        job_id = self.create_job()
+        for attempt in range(self.RETRY_ATTEMPTS):
+            jobs = self.abort_job(job_id)
+            job_id = jobs[-1].id
+            self.claim_job(job_id)
+
+        # No further retry, and the last job is dead-lettered
+        jobs = self.abort_job(job_id)
+        self.assertEqual(self.RETRY_ATTEMPTS + 1, len(jobs))
+        self.assertFalse(jobs[-1].successful)
+        self.assertTrue(jobs[-1].owner.startswith(
+            ChatPersister.DEAD_LETTER_OWNER_PREFIX + self.OWNER))
+        for job in jobs[:-1]:
+            self.assertFalse(job.owner.startswith(
+                ChatPersister.DEAD_LETTER_OWNER_PREFIX))
+
+        # A rerun of the chat session starts a new retry chain
+        job_id = self.create_job()
+        jobs = self.abort_job(job_id)
+        self.assertEqual(self.RETRY_ATTEMPTS + 3, len(jobs))
+        self.assert_retry(jobs[-1], self.RETRY_SECONDS)
+
+
+class ChatHighlightTest(IntegrationTestCase):
+    """
+        Test the creation of ChatHighlightSessions for
+        the participants of a persisted chat.
+
+        The test chat sessions have no ChatPersistJob,
+        so are not processed by the persist service.
+    """
+
+    def setUp(self):
+        self.test_user_id = 1
+        self.root_topic = Topic(
+            parent_id=None,
+            rank=0,
+            title="HighlightTestChat",
+            description="Chat topic used to test chat highlights",
+            duration=60, # secs
+            public=True,
+            active=True,
+            recommended_participants=1,
+            user_id=self.test_user_id,
+            type_id=1
+        )
+        self.chat = Chat(
+            type_id=1,
+            topic=self.root_topic,
+            start=tz.utcnow(),
+            end=tz.utcnow()+datetime.timedelta(minutes=5))
+        self.chat_sessions = [
+            ChatSession(chat=self.chat, token="highlight_test_token_%d" % i, participants=1)
+            for i in range(3)]
+
+        db_session = self.service.handler.get_database_session()
+        try:
+            db_session.add(self.root_topic)
+            db_session.add(self.chat)
+            for chat_session in self.chat_sessions:
+                db_session.add(chat_session)
+            db_session.commit()
+            self.chat_id = self.chat.id
+            self.root_topic_id = self.root_topic.id
+            self.chat_session_ids = [chat_session.id for chat_session in self.chat_sessions]
+
+            # Rank of the test user's last highlight, if any
+            self.max_rank = db_session.query(func.max(ChatHighlightSession.rank)).\
+                filter_by(user_id=self.test_user_id).\
+                scalar()
+            if self.max_rank is None:
+                self.max_rank = -1
+        finally:
+            db_session.close()
+
+    def tearDown(self):
+        db_session = self.service.handler.get_database_session()
+        try:
+            db_session.query(ChatHighlightSession).\
+                filter(ChatHighlightSession.chat_session_id.in_(self.chat_session_ids)).\
+                delete(synchronize_session=False)
+            for chat_session in self.chat_sessions:
+                db_session.delete(chat_session)
+            db_session.delete(self.chat)
+            db_session.delete(self.root_topic)
+            db_session.commit()
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            db_session.close()
+
+    def create_highlight(self, chat_session_id, rank):
+        db_session = self.service.handler.get_database_session()
+        try:
+            db_session.add(ChatHighlightSession(
+                chat_session_id=chat_session_id,
+                user_id=self.test_user_id,
+                rank=rank))
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def get_highlights(self, chat_session_id):
+        db_session = self.service.handler.get_database_session()
+        try:
+            return db_session.query(ChatHighlightSession).\
+                filter_by(chat_session_id=chat_session_id).\
+                all()
+        finally:
+            db_session.close()
+
+    def create_chat_highlight(self, chat_session_id, title="HighlightTestChat"):
+        """Create the highlights of a chat session with a ChatPersister."""
+        persister = ChatPersister(
+            self.service.handler.get_database_session, 0, "highlight-test")
+        persister._set_job_context(ChatPersistJobContext(
+            0, chat_session_id, self.chat_id, self.root_topic_id,
+            title, [self.test_user_id]))
+        db_session = self.service.handler.get_database_session()
+        try:
+            persister._create_chat_highlight(db_session)
+        finally:
+            db_session.close()
+
+    def test_rank_after_last_highlight(self):
+        # Ranks may have gaps, so the new highlight is ranked
+        # after the highest rank rather than the count.
+        self.create_highlight(self.chat_session_ids[1], self.max_rank + 1)
+        self.create_highlight(self.chat_session_ids[2], self.max_rank + 5)
+
+        self.create_chat_highlight(self.chat_session_ids[0])
+        highlights = self.get_highlights(self.chat_session_ids[0])
+        self.assertEqual(1, len(highlights))
+        self.assertEqual(self.test_user_id, highlights[0].user_id)
+        self.assertEqual(self.max_rank + 6, highlights[0].rank)
+
+    def test_highlight_already_exists(self):
+        # An existing highlight for the chat is left as is
+        self.create_highlight(self.chat_session_ids[0], self.max_rank + 1)
+        self.create_highlight(self.chat_session_ids[1], self.max_rank + 2)
+
+        self.create_chat_highlight(self.chat_session_ids[0])
+        highlights = self.get_highlights(self.chat_session_ids[0])
+        self.assertEqual(1, len(highlights))
+        self.assertEqual(self.max_rank + 1, highlights[0].rank)
+
+    def test_tutorial_chat(self):
+        self.create_chat_highlight(self.chat_session_ids[0], title="Tutorial")
+        self.assertEqual([], self.get_highlights(self.chat_session_ids[0]))
+
+
 if __name__ == '__main__':
     unittest.main()
 
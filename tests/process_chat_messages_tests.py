@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+import sys
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+from trpycore.thrift.serialization import serialize
+
+from chat_test_data import ChatTestDataSets
+from persister import process_chat_messages
+
+
+class ProcessChatMessagesTest(unittest.TestCase):
+    """
+        Test the process_chat_messages compute stage
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # Get chat data
+        chat_data = ChatTestDataSets()
+        cls.test_chat_datasets = chat_data.get_list()
+
+    def get_args(self, chat_data):
+        return (
+            chat_data.chat_session_id,
+            chat_data.topic_collection.as_list_by_rank(),
+            [serialize(message) for message in chat_data.message_list])
+
+    def assertRows(self, chat_data, rows):
+        # Check minute rows ordered by topic rank
+        expected_models = chat_data.expected_minute_models
+        self.assertEqual(len(expected_models), len(rows["minutes"]))
+        for index, row in enumerate(rows["minutes"]):
+            self.assertEqual(expected_models[index].topic_id, row["topic_id"])
+            self.assertEqual(expected_models[index].start, row["start"])
+            self.assertEqual(expected_models[index].end, row["end"])
+
+        # Check marker and tag rows reference their minute's topic
+        self.assertEqual(len(chat_data.expected_marker_models), len(rows["markers"]))
+        for index, row in enumerate(rows["markers"]):
+            expected_model = chat_data.expected_marker_models[index]
+            self.assertEqual(expected_model.user_id, row["user_id"])
+            self.assertEqual(expected_model.chat_minute.topic_id, row["topic_id"])
+
+        self.assertEqual(len(chat_data.expected_tag_models), len(rows["tags"]))
+        for index, row in enumerate(rows["tags"]):
+            expected_model = chat_data.expected_tag_models[index]
+            self.assertEqual(expected_model.name, row["name"])
+            self.assertEqual(expected_model.chat_minute.topic_id, row["topic_id"])
+
+    def test_process_chat_messages(self):
+        for chat_data in self.test_chat_datasets:
+            rows = process_chat_messages(*self.get_args(chat_data))
+            self.assertRows(chat_data, rows)
+
+    def test_process_chat_messages_in_pool(self):
+        pool = multiprocessing.Pool(1)
+        try:
+            for chat_data in self.test_chat_datasets:
+                rows = pool.apply(process_chat_messages, self.get_args(chat_data))
+                self.assertRows(chat_data, rows)
+        finally:
+            pool.close()
+            pool.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import unittest
+
+SERVICE_NAME = "persistsvc"
+#Add SERVICE_ROOT to python path, for imports.
+SERVICE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", SERVICE_NAME))
+sys.path.insert(0, SERVICE_ROOT)
+
+from topic_collection_cache import TopicCollectionCache
+from topic_data_manager import TopicData, TopicDataCollection
+
+
+class CacheTestTopicDataManager(object):
+    """
+        Stand-in for the TopicDataManager which counts
+        the collections read.
+    """
+    def __init__(self):
+        self.num_reads = 0
+
+    def get_collection(self, db_session, root_topic_id):
+        self.num_reads += 1
+        return TopicDataCollection([
+            TopicData(root_topic_id, None, 0, 1, "Root", None)])
+
+
+class TopicCollectionCacheTest(unittest.TestCase):
+    """
+        Test the TopicCollectionCache class
+    """
+
+    def create_cache(self, max_size=None, ttl_seconds=None):
+        cache = TopicCollectionCache(max_size, ttl_seconds)
+        cache.topics_manager = CacheTestTopicDataManager()
+        return cache
+
+    def test_get_collection(self):
+        cache = self.create_cache()
+        collection = cache.get_collection(None, 1)
+        self.assertIs(collection, cache.get_collection(None, 1))
+        self.assertIsNot(collection, cache.get_collection(None, 2))
+        self.assertEqual(2, cache.topics_manager.num_reads)
+
+        counters = cache.get_counters()
+        self.assertEqual(1, counters["topic_cache_hits"])
+        self.assertEqual(2, counters["topic_cache_misses"])
+        self.assertEqual(2, counters["topic_cache_size"])
+
+    def test_evict_least_recently_used(self):
+        cache = self.create_cache(max_size=2)
+        cache.get_collection(None, 1)
+        cache.get_collection(None, 2)
+        cache.get_collection(None, 1)
+        cache.get_collection(None, 3)
+
+        # Topic 2 was evicted
+        self.assertEqual(3, cache.topics_manager.num_reads)
+        cache.get_collection(None, 1)
+        self.assertEqual(3, cache.topics_manager.num_reads)
+        cache.get_collection(None, 2)
+        self.assertEqual(4, cache.topics_manager.num_reads)
+
+    def test_expire(self):
+        cache = self.create_cache(ttl_seconds=0.01)
+        collection = cache.get_collection(None, 1)
+        time.sleep(0.02)
+        self.assertIsNot(collection, cache.get_collection(None, 1))
+        self.assertEqual(2, cache.topics_manager.num_reads)
+
+    def test_clear(self):
+        cache = self.create_cache()
+        cache.get_collection(None, 1)
+        cache.clear()
+        cache.get_collection(None, 1)
+        self.assertEqual(2, cache.topics_manager.num_reads)
+
+    def test_get_derived(self):
+        collection = self.create_cache().get_collection(None, 1)
+        derived = collection.get_derived("test", lambda: {1: []})
+        self.assertIs(derived, collection.get_derived("test", lambda: {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
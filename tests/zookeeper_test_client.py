@@ -0,0 +1,122 @@
+import threading
+
+import zookeeper
+
+
+class ZookeeperTestEvent(object):
+    """
+        Watch event delivered by the ZookeeperTestClient.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+
+class ZookeeperTestServer(object):
+    """
+        In-process stand-in for a ZooKeeper ensemble.
+
+        Multiple ZookeeperTestClient objects may share a
+        ZookeeperTestServer to simulate multiple service
+        instances. Only the subset of ZooKeeper behavior
+        used by the persist service is supported:
+        persistent, ephemeral and sequential nodes, and
+        one-shot children watches.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.nodes = {"/": None}
+        self.ephemeral_owners = {}
+        self.children_watches = {}
+        self.sequence = 0
+
+    def _parent(self, path):
+        parent = path.rsplit("/", 1)[0]
+        return parent or "/"
+
+    def _fire_children_watches(self, path):
+        watches = self.children_watches.pop(path, [])
+        for watcher in watches:
+            watcher(ZookeeperTestEvent(path))
+
+    def create(self, client, path, data, sequence, ephemeral):
+        with self.lock:
+            if sequence:
+                path = "%s%010d" % (path, self.sequence)
+                self.sequence += 1
+            if path in self.nodes:
+                raise zookeeper.NodeExistsException()
+            parent = self._parent(path)
+            if parent not in self.nodes:
+                raise zookeeper.NoNodeException()
+            self.nodes[path] = data
+            if ephemeral:
+                self.ephemeral_owners[path] = client
+            self._fire_children_watches(parent)
+            return path
+
+    def delete(self, path):
+        with self.lock:
+            if path not in self.nodes:
+                raise zookeeper.NoNodeException()
+            if self.get_children(path):
+                raise zookeeper.NotEmptyException()
+            del self.nodes[path]
+            self.ephemeral_owners.pop(path, None)
+            self._fire_children_watches(self._parent(path))
+
+    def exists(self, path):
+        with self.lock:
+            return path in self.nodes
+
+    def get_data(self, path):
+        with self.lock:
+            if path not in self.nodes:
+                raise zookeeper.NoNodeException()
+            return self.nodes[path]
+
+    def get_children(self, path, watcher=None):
+        with self.lock:
+            if path not in self.nodes:
+                raise zookeeper.NoNodeException()
+            prefix = path.rstrip("/") + "/"
+            children = [node[len(prefix):] for node in self.nodes
+                    if node.startswith(prefix) and "/" not in node[len(prefix):]]
+            if watcher is not None:
+                self.children_watches.setdefault(path, []).append(watcher)
+            return sorted(children)
+
+    def expire_session(self, client):
+        with self.lock:
+            for path, owner in self.ephemeral_owners.items():
+                if owner is client:
+                    self.delete(path)
+
+
+class ZookeeperTestClient(object):
+    """
+        In-process stand-in for the ZookeeperClient.
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    def create(self, path, data=None, acl=None, sequence=False, ephemeral=False):
+        return self.server.create(self, path, data, sequence, ephemeral)
+
+    def delete(self, path, version=-1):
+        self.server.delete(path)
+
+    def exists(self, path, watcher=None):
+        return self.server.exists(path)
+
+    def get_data(self, path, watcher=None):
+        return self.server.get_data(path)
+
+    def get_children(self, path, watcher=None):
+        return self.server.get_children(path, watcher)
+
+    def expire_session(self):
+        """Simulate session expiration, deleting ephemeral nodes."""
+        self.server.expire_session(self)